@@ -1,694 +1,1149 @@
-
-'''
-Author:Gabriel Fuentes
-gabriel.fuentes@snf.no'''
-
-# Import required libraries
-import pathlib
-import dash
-import numpy as np
-from dash.dependencies import Input, Output, State, ClientsideFunction
-import dash_core_components as dcc
-import dash_html_components as html
-import plotly.figure_factory as ff
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import plotly.express as px
-from dateutil.relativedelta import *
-from datetime import datetime
-
-from controls import TYPE_COLORS,PORTS_COLORS,FLEET
-from choropleth_map_emission import choropleth_map, sum_by_hexagon
-
-##DataFrames
-from data_filtering import processed_data
-import pandas as pd
-import geopandas as gpd
-import os
-import requests
-
-##Databases
-##Databases
-panama_ports=gpd.read_file("data/Panama_ports.geojson")
-
-canal,ports=processed_data(FLEET)
-gatun=pd.read_csv("data/draught_restr_data.csv")
-
-em=pd.read_csv("data/emissions_type_monthly.csv")
-em["dt_pos_utc"]=pd.to_datetime(em["dt_pos_utc"])
-
-pol=gpd.read_file("data/Panama_Canal.geojson")[["Name","geometry"]]
-pol=pol[pol.geometry.apply(lambda x: x.geom_type=="Polygon")]
-
-##Transform to datetime. Preferred to read csv method which is less flexible.
-
-canal["time_at_entrance"]=pd.to_datetime(canal["time_at_entrance"])
-ports["initial_service"]=pd.to_datetime(ports["initial_service"])
-gatun["Date"]=pd.to_datetime(gatun["Date"])
-
-##Ports color
-panama_ports=panama_ports.assign(color="#F9A054")
-
-# get relative data folder
-PATH = pathlib.Path(__file__).parent
-DATA_PATH = PATH.joinpath("data").resolve()
-
-app = dash.Dash(
-    __name__, meta_tags=[{"name": "viewport", "content": "width=device-width"}]
-)
-
-app.title = 'Panama Maritime Stats'
-
-server = app.server
-
-# Create global chart template
-
-MAPBOX_TOKEN = os.environ.get('MAPBOX_TOKEN', None)
-
-layout_map = dict(
-    autosize=True,
-    paper_bgcolor='#30333D',
-    plot_bgcolor='#30333D',
-    margin=dict(l=10, r=10, b=10, t=10),
-    hovermode="closest",
-    font=dict(family="HelveticaNeue",size=17,color="#B2B2B2"),
-    legend=dict(font=dict(size=10), orientation="h"),
-    mapbox=dict(
-        accesstoken=MAPBOX_TOKEN,
-        style='mapbox://styles/gabrielfuenmar/ckhs87tuj2rd41amvifhb26ad',
-        center=dict(lon=-79.55, lat=8.93),
-        zoom=9,
-    ),
-    showlegend=False,
-)
-
-layout= dict(
-    legend=dict(bgcolor='rgba(0,0,0,0)',font=dict(size=14,family="HelveticaNeue")),
-    font_family="HelveticaNeue",
-    font_color="#B2B2B2",
-    title_font_family="HelveticaNeue",
-    title_font_color="#B2B2B2",
-    title_font_size=20,
-    paper_bgcolor='#21252C',
-    plot_bgcolor='#21252C',
-    xaxis=dict(gridcolor="rgba(178, 178, 178, 0.1)",title_font_size=15,
-               tickfont_size=14,title_font_family="HelveticaNeue",tickfont_family="HelveticaNeue"),
-    yaxis=dict(gridcolor="rgba(178, 178, 178, 0.1)",title_font_size=15,tickfont_size=14,
-               title_font_family="HelveticaNeue",tickfont_family="HelveticaNeue")
-    )
-
-##Modebar on graphs
-config={"displaylogo":False, 'modeBarButtonsToRemove': ['autoScale2d']}
-
-
-##Annotation on graphs
-annotation_layout=dict(
-    xref="x domain",
-    yref="y domain",
-    x=0.25,
-    y=-0.35)
-
-# Create app layout
-app.layout = html.Div(
-    [
-        dcc.Store(id="aggregate_data"),
-        # empty Div to trigger javascript file for graph resizing
-        html.Div(id="output-clientside"),
-        html.Div(
-            [
-                html.Div(
-                    [
-                        html.A(html.Img(
-                            src=app.get_asset_url("mtcc_logo_v3.png"),
-                            id="plotly-image",
-                            style={
-                                "height": "160px",
-                                "width": "auto",
-                                "margin-bottom": "0px",
-                                "text-align": "center"
-                            },
-                        ),
-                            href="https://mtcclatinamerica.com/")
-                    ],
-                    className="one-half column",
-                ),
-                html.Div(
-                    [
-                        html.Div(
-                            [
-                                html.H3(
-                                    "Panama Maritime Statistics",
-                                    style={"margin-bottom": "0px"},
-                                ),
-                                html.H5(
-                                    "Efficiency and Sustainability Indicators", style={"margin-top": "0px"}
-                                ),
-                            ]
-                        )
-                    ],
-                    className="one-half column",
-                    id="title",
-                ),
-                html.Div(
-                    [
-                        html.Button("Refresh", id="refresh-button"), 
-                        html.A(
-                            html.Button("Developer", id="home-button"),
-                            href="https://gabrielfuentes.org",
-                        )                  
-                    ],
-                    className="one-third column",
-                    id="button",
-                    style={
-                        "text-align": "center"},
-                ),
-            ],
-            id="header",
-            className="row flex-display",
-            style={"margin-bottom": "15px"},
-        ),
-        html.Div(
-            [
-                html.Div(
-                    [
-                      html.P("Date Filter",
-                                    className="control_label",
-                                ),
-                                html.Div([html.P(id="date_from"),
-                                html.P(id="date_to")],className="datecontainer")
-                            ,
-                        dcc.RangeSlider(
-                            id="year_slider",
-                            min=0,
-                            max=20,
-                            value=[0, 20],
-                            marks={
-                                0:"Dec 2018",
-                                5:"May 2019",
-                                10:"Oct 2019",
-                                15:"Mar 2020",
-                                20:"Aug 2020"},
-                            allowCross=False,
-                            className="dcc_control",
-                        ),
-                        html.P("Vessel Type:", className="control_label"),
-                        dcc.Dropdown(
-                            id='types-dropdown',
-                            options=[{'label': row,'value': row} \
-                                     for row in sorted(FLEET)],
-                                    placeholder="All",multi=True,
-                                    className="dcc_control"),
-                        html.P("Port:", className="control_label"),
-                        dcc.Dropdown(
-                            id='ports-dropdown',
-                            options=[{'label': row,'value': row} \
-                                     for row in sorted(ports[~ports.port_name.isin(["Pacific - PATSA","Colon2000"])]\
-                                                             .dropna(subset=["port_name"]).port_name.unique())+["Panama Canal South", "Panama Canal North"]],
-                                    placeholder="All",multi=True,
-                                    className="dcc_control"),
-                        html.P(
-                            "Vessel Size (GT)",
-                            className="control_label",
-                        ),
-                        html.Div([html.P(id="size_from"),
-                                html.P(id="size_to")],className="datecontainer"),
-                        
-                        dcc.RangeSlider(
-                            id="size_slider",
-                            min=400,
-                            max=170000,
-                            value=[400, 170000],
-                            step=8500,
-                            marks={
-                                400:"400",
-                                35000:"35k",
-                                70000:"70k",
-                                105000:"105k",
-                                140000:"140k",
-                                170000:"170k"},
-                            allowCross=False,
-                            className="dcc_control",
-                        ),
-                    ],
-                    className="pretty_container four columns",
-                    id="cross-filter-options",
-                ),
-                html.Div(
-                    [
-                        html.Div(
-                            [
-                                html.Div(
-                                    [html.H6(id="waitingText"), html.P("Waiting Average")],
-                                    id="waiting",
-                                    className="mini_container",
-                                ),
-                                html.Div(
-                                    [html.H6(id="opsText"), html.P("Operations")],
-                                    id="ops",
-                                    className="mini_container",
-                                ),
-                                html.Div(
-                                    [html.H6(id="serviceText"), html.P("Service Average")],
-                                    id="service_m",
-                                    className="mini_container",
-                                ),
-                                html.Div(#####Hardcoded for the time being. Build a scrapper.
-                                    [html.H6(["15.24 m"],id="draughtText"), html.P("Canal Max Draught TFW")],
-                                    id="draught",
-                                    className="mini_container",
-                                ),
-                            ],
-                            id="info-container",
-                            className="row container-display",
-                        ),
-                        html.Div([
-                            html.Div(
-                                    [
-                                        html.Div([html.H5("Emissions Review"),
-                                                  html.H6(id="month_map",style={"color":"white"})],
-                                                            style={"display": "flex", "flex-direction": "row","justify-content":"space-between"}),
-                                        dcc.Graph(animate=False,config=config,id="map_in"),
-                                             html.P(["Grid size"],id="grid_size",className="control_label"),
-                                                         dcc.Slider(
-                                                         id="zoom_slider",
-                                                         min=4,
-                                                         max=8,
-                                                         value=8,
-                                                         marks={4:{'label': '1'},5:{'label': '2'},6:{'label': '3'},
-                                                            7:{'label': '4'},8:{'label': '5'}},
-                                                         className="dcc_control",
-                                                         included=False),
-                                                             dcc.RadioItems(
-                                                             id='selector',options=[{'label': "CO2 emissions", 'value': "co2"},
-                                                                                    {'label': "CH4 emissions", 'value': "ch4"}],
-                                                             value="co2",labelStyle={'display': 'inline-block'}),
-                                           ],
-                                id="emissionsMapContainer",
-                                className="pretty_container eight columns",
-                                )
-                            ],
-                            className="row flex-display",
-                            ),
-                        ],
-                    id="right-column",
-                    className="eight columns",
-                ),
-            ],
-            className="row flex-display",
-        ),
-        html.Div(
-            [
-                html.Div(
-                    [dcc.Graph(id="service_graph",config=config)],
-                    className="pretty_container six columns",
-                ),
-                html.Div(
-                    [dcc.Graph(id="waiting_graph",config=config)],
-                    className="pretty_container six columns",
-                )
-            ],
-            className="row flex-display",
-        ),
-        html.Div(
-            [
-                html.Div(
-                    [dcc.Graph(id="draught_graph",config=config)],
-                    className="pretty_container six columns",
-                ),
-                html.Div(
-                    [dcc.Graph(id="ratio_graph",config=config)],
-                    className="pretty_container six columns",
-                ),
-            ],
-            className="row flex-display",
-        ),
-    ],
-    id="mainContainer",
-    style={"display": "flex", "flex-direction": "column"},
-)
-
-    
-def upper_text_p1(fr="01-01-2019",to="18-11-2020",ports_sel=["All"],
-                type_vessel=["All"],size=["All"],text_bar=True,*args):
-    
-    date_from=pd.to_datetime(fr)
-    date_to=pd.to_datetime(to)
-    
-    canal_in=canal[(canal.time_at_entrance.between(date_from,date_to))&(canal.direct_transit_boolean==True)].\
-        copy()
-    ports_in=ports[ports.initial_service.between(date_from,date_to)].\
-        copy()
-    canal_in=canal_in.assign(day=canal_in.time_at_entrance.dt.date)
-    canal_in=canal_in[["day","waiting_time","service_time","port_name","draught_ratio","StandardVesselType","GT"]]
-    canal_in["day"]=pd.to_datetime(canal_in.day)
-    ports_in=ports_in.assign(day=ports_in.initial_service.dt.date)
-    ports_in=ports_in[["day","waiting_time","service_time","port_name","draught_ratio","StandardVesselType","GT"]]
-    ports_in["day"]=pd.to_datetime(ports_in.day)
-    
-    df_in=pd.concat([ports_in,canal_in],axis=0)
-    
-    if "All" not in ports_sel:
-        df_in=df_in[df_in.port_name.isin(ports_sel)]
-    
-    if "All" not in size:
-        df_in=df_in[df_in.GT.between(size[0],size[1])]
-        
-    if "All" not in type_vessel:
-        df_in=df_in[df_in["StandardVesselType"].isin(type_vessel)]
-        
-    if text_bar is True: ##Row at top with summary values
-        waiting_mean=df_in.waiting_time.mean()
-        ops=df_in.shape[0]
-        service_mean=df_in.service_time.mean()
-
-        return waiting_mean,ops,service_mean
-    
-    else: ###Graphs on waiting, service time and draught ratio
-        
-        ##Fig ratio
-        df_in=df_in[df_in.day>pd.to_datetime("01-01-2019")]
-        df_in=df_in.reset_index(drop=True)
-        series_grouped=[]
-        for name,row in df_in.\
-        groupby([df_in.day.dt.isocalendar().week,df_in.day.dt.year,"StandardVesselType"]):
-            series_grouped.append([pd.to_datetime(str(name[1])+"-"+str(name[0])+"-1",format='%Y-%W-%w'),name[2],row.draught_ratio.mean()])
-        
-        series_grouped=pd.DataFrame(series_grouped,columns=["day","StandardVesselType","draught_ratio"]).sort_values(by=["day"])
-        
-        draught_fig = go.Figure()
-        
-        for val in series_grouped["StandardVesselType"].unique():
-            series_in=series_grouped[series_grouped["StandardVesselType"]==val]
-            draught_fig.add_trace(go.Scatter(
-                name=val,
-                mode="markers+lines",
-                x=series_in.day,y=series_in.draught_ratio,
-                line=dict(shape="spline", width=1, color=TYPE_COLORS[val]),
-                marker=dict(symbol="diamond-open")))
-        
-        
-        draught_fig.update_layout(layout,legend=dict(x=1),title_text="<b>Draught Ratio per vessel type</b>",
-                                  xaxis=dict(title_text="Date"),yaxis=dict(title_text="Ratio"),)
-        draught_fig.add_annotation(annotation_layout,text="*AIS draft/min(maxTFWD, max Allowable draft)")
-        ##Service and waiting time
-        labels_w=[]
-        remove_w=[]
-        waiting=[]
-        
-        for name,row in df_in.groupby("port_name"):
-            if len(row.waiting_time.dropna().tolist())>25:      
-                labels_w.append(name)
-                wa_li=row.waiting_time[(row.waiting_time>1)&(row.waiting_time<row.waiting_time.quantile(0.95))&\
-                                       (row.waiting_time>row.waiting_time.quantile(0.05))]
-                waiting.append(wa_li.dropna().tolist())
-            else:
-                remove_w.append(name)
-                
-        labels_s=[]
-        remove_s=[]
-        service=[]
-    
-        
-        for name,row in df_in.groupby("port_name"):
-            if len(row.service_time.dropna().tolist())>25:  
-                labels_s.append(name)
-                se_li=row.service_time[(row.service_time>0)&(row.service_time<row.service_time.quantile(0.95))&\
-                       (row.service_time>row.service_time.quantile(0.05))]
-                service.append(se_li.dropna().tolist())
-            else:
-                remove_s.append(name)
-             
-        ##Figs of waiting and service time
-        
-        if len(labels_w)>0:
-            fig_waiting = ff.create_distplot(waiting, labels_w,histnorm="probability density",colors=list(PORTS_COLORS.values()),show_rug=False,show_curve=False)
-            
-        else:
-            fig_waiting=go.Figure()
-            fig_waiting.add_annotation(x=2,y=5,xref="x",yref="y",text="max=5",showarrow=True,
-            font=dict(family="Courier New, monospace",size=16, color="#ffffff"),align="center",
-            arrowhead=2, arrowsize=1, arrowwidth=2,arrowcolor="#636363", ax=20,ay=-30,bordercolor="#c7c7c7",
-            borderwidth=2,borderpad=4,bgcolor="#ff7f0e",opacity=0.8)
-        
-        if len(labels_s)>0:
-            fig_service = ff.create_distplot(service, labels_s,histnorm="probability density",colors=list(PORTS_COLORS.values()),show_rug=False,show_curve=False)
-        else:
-            fig_service=go.Figure()
-            fig_service.add_annotation(x=2,y=5,xref="x",yref="y",text="max=5",showarrow=True,
-            font=dict(family="Courier New, monospace",size=16, color="#ffffff"),align="center",
-            arrowhead=2, arrowsize=1, arrowwidth=2,arrowcolor="#636363", ax=20,ay=-30,bordercolor="#c7c7c7",
-            borderwidth=2,borderpad=4,bgcolor="#ff7f0e",opacity=0.8)
-        
-        
-        ###Service and Waiting Graphs Layout
-        fig_waiting.update_layout(layout,yaxis=dict(zeroline=True,linecolor='white',title_text="Density"),
-                                  xaxis=dict(title_text="Hours"),
-                                  legend=dict(x=0.6),title_text="<b>Waiting Time</b>")
-        fig_waiting.add_annotation(annotation_layout,text="*Results from inbuilt method by Fuentes, Sanchez-Galan and Diaz")
-        fig_waiting.update_traces(marker_line_color='rgb(8,48,107)',
-                                  marker_line_width=1.5, opacity=0.6)
-        fig_service.update_layout(layout,yaxis=dict(zeroline=True,linecolor="white",title_text="Density"),
-                                  xaxis=dict(title_text="Hours"),
-                                  legend=dict(x=0.6),title_text="<b>Service Time</b>")
-        fig_service.add_annotation(annotation_layout,text="*Results from inbuilt method by Fuentes, Sanchez-Galan and Diaz")
-        fig_service.update_traces(marker_line_color='rgb(8,48,107)',
-                                  marker_line_width=1.5, opacity=0.6)
-        
-        
-        return fig_waiting,fig_service,draught_fig
-        
-def lake_draught(fr="01-01-2015",to="18-11-2020",*args):
-    gatun_in=gatun.copy()
-    date_from=pd.to_datetime(fr)
-    date_to=pd.to_datetime(to)
-    
-    gatun_in=gatun_in[gatun_in.Date.between(date_from,date_to)]
-    gatun_in=gatun_in.assign(day=gatun_in.Date.dt.day.astype(str)+"/"+gatun_in.Date.dt.month.astype(str)+"/"+gatun_in.Date.dt.year.astype(str))
-    lake_fig=make_subplots(specs=[[{"secondary_y": True}]])
-    lake_fig.add_trace(go.Scatter(
-                name="Gatun Lake Depth",
-                mode="lines",
-                x=gatun_in.day,y=gatun_in.gatun_depth,
-                line=dict(shape="spline", width=2,color="#6671FD")),secondary_y=True)
-    
-    lake_fig.add_trace(go.Scatter(
-                name="Draught Change",
-                mode="lines",
-                x=gatun_in[gatun_in.Change.notnull()]["day"],y=gatun_in[gatun_in.Change.notnull()]["Change"],
-                line=dict(shape="spline", width=2,color="#3ACC95"),
-                marker=dict(symbol="diamond-open")),secondary_y=False)
-    
-    lake_fig.add_trace(go.Scatter(
-                name="Max draught",
-                mode="lines",
-                x=gatun_in.day,y=gatun_in.Overall,
-                line=dict(shape="spline", width=2,color="#F9A054")),secondary_y=False)
-    
-    ##Layout update  
-    lake_fig.update_layout(layout,title_text="<b>Gatun Lake and Draught Restriction Relation</b>",
-                           xaxis=dict(title_text="Date",nticks=6),
-                           legend=dict(x=0.6,y=1))
-    
-    # Set y-axes titles
-    lake_fig.update_yaxes(title_text="Max Draught (m)", secondary_y=False,showgrid=False,
-                          range=[gatun_in.Overall.min()*0.99,gatun_in.Overall.max()*1.05])
-    lake_fig.update_yaxes(title_text="Lake Depth (m)", secondary_y=True,gridcolor="rgba(178, 178, 178, 0.1)",
-                          title_font_size=15,tickfont_size=14,
-                          title_font_family="HelveticaNeue",tickfont_family="HelveticaNeue",
-                          range=[gatun_in.gatun_depth.min()*0.99,gatun_in.gatun_depth.max()*1.05])
-    lake_fig.add_annotation(annotation_layout,text="*Values sourced by the Panama Canal Authority Maritime Services Platform")
-    return lake_fig
-    
-def emissions_map(ghg,res,fr="01-01-2018",to="30-08-2020",lat=None,lon=None,zoom=None,type_vessel=[],size=[]):
-    
-    emissions_in=em.copy()
-    date_fr=pd.to_datetime(fr)
-    date_to=pd.to_datetime(to)
-    
-    df_aggreg=sum_by_hexagon(emissions_in,res,pol,date_fr,date_to,vessel_type=type_vessel,gt=size)
-    
-    
-    ##Update layout
-    if lat is not None:
-        layout_map["mapbox"]["center"]["lon"]=lon
-        layout_map["mapbox"]["center"]["lat"]=lat
-        layout_map["mapbox"]["zoom"]=zoom
-        
-    if df_aggreg.shape[0]>0:
-        heatmap=choropleth_map(ghg,df_aggreg,layout_map)
-    else:
-        heatmap=go.Figure(data=go.Scattermapbox(lat=[0],lon=[0]),layout=layout_map)
-
-    return heatmap
-
-##Upper Row,
-@app.callback(
-    [
-        Output("waitingText", "children"),
-        Output("opsText", "children"),
-        Output("serviceText", "children"),
-        Output("date_from","children"),
-        Output("date_to","children"),
-        Output("size_from","children"),
-        Output("size_to","children"),
-    ],
-    [Input("ports-dropdown", "value"),
-     Input("types-dropdown","value"),
-     Input('year_slider', 'value'),
-     Input('size_slider', 'value'),
-     ],
-)
-def update_row1(ports_val,types_val,date,size_val):
-    if not ports_val:
-        ports_val=["All"]
-    if not types_val:
-        types_val=["All"]
-    
-    date_fr=pd.to_datetime("12-01-2018 00:00")+relativedelta(months=+date[0])
-    date_to=pd.to_datetime("12-01-2018 00:00")+relativedelta(months=+date[1])
-    date_to=date_to+ relativedelta(day=31)  
-    
-    if date[0]==0:
-        date_fr=pd.to_datetime("31-12-2018")    
-    
-    date_fr=date_fr.strftime('%d-%m-%Y')
-    date_to=date_to.strftime('%d-%m-%Y')
-    
-    waiting,ops,service=upper_text_p1(fr=date_fr,to=date_to,ports_sel=ports_val,type_vessel=types_val,size=size_val)
-    
-    return "{:.1f}".format(waiting)+ " hours", format(ops,","), "{:.1f}".format(service) + " hours",\
-        date_fr, date_to ,format(size_val[0],","),format(size_val[1],",")
-    
-
-@app.callback(
-    [
-        Output("service_graph", "figure"),
-        Output("waiting_graph", "figure"),
-        Output("ratio_graph", "figure"),
-
-    ],
-    [Input("ports-dropdown", "value"),
-      Input("types-dropdown","value"),
-      Input('year_slider', 'value'),
-      Input('size_slider', 'value'),
-      ],
-)
-
-
-def update_graphs(ports_val,types_val,date,size_val):
-    if not ports_val:
-        ports_val=["All"]
-    if not types_val:
-        types_val=["All"]
-  
-    date_fr=pd.to_datetime("12-01-2018 00:00")+relativedelta(months=+date[0])
-    date_to=pd.to_datetime("12-01-2018 00:00")+relativedelta(months=+date[1])
-    date_to=date_to+ relativedelta(day=31)  
-    
-    if date[0]==0:
-        date_fr=pd.to_datetime("31-12-2018")    
-    
-    date_fr=date_fr.strftime('%d-%m-%Y')
-    date_to=date_to.strftime('%d-%m-%Y')
-    
-    service_g,waiting_g,ratio_g=upper_text_p1(fr=date_fr,to=date_to,ports_sel=ports_val,type_vessel=types_val,size=size_val,text_bar=False)
-    
-    return service_g,waiting_g,ratio_g
-
-@app.callback(
-    Output("draught_graph", "figure"),
-    [ Input('year_slider', 'value'),
-      ],
-)
-
-def update_gatun(date):
-
-    date_fr=pd.to_datetime("12-01-2018 00:00")+relativedelta(months=+date[0])
-    date_to=pd.to_datetime("12-01-2018 00:00")+relativedelta(months=+date[1])
-    date_to=date_to+ relativedelta(day=31)  
-    
-    if date[0]==0:
-        date_fr="30-12-2018"
-    
-    if date[1]==20:
-        date_to="18-11-2020"
-        
-    lake_g=lake_draught(fr=date_fr,to=date_to)
-    
-    return lake_g
-
-@app.callback(
-    Output("map_in", "figure"),
-    [Input("selector","value"),
-     Input("zoom_slider","value"),
-     Input('year_slider', 'value'),
-     Input("types-dropdown","value"),
-      ],
-    [State("map_in","relayoutData")]
-)
-
-def update_emissions_map(ghg_t,resol,date,types_val,relay):
-    
-    date_fr=pd.to_datetime("01-01-2019 00:00")+relativedelta(months=+date[0])
-    date_to=pd.to_datetime("01-01-2019 00:00")+relativedelta(months=+date[1])
-    date_to=date_to+ relativedelta(day=31)
-    
-    if relay is not None:   
-        if "mapbox.center" in relay.keys():
-            lat=relay["mapbox.center"]["lat"]
-            lon=relay["mapbox.center"]["lon"]
-            zoom=relay["mapbox.zoom"]
-        else:
-            lat=8.93
-            lon=-79.55
-            zoom=9
-    else:
-        lat=8.93
-        lon=-79.55
-        zoom=9
-    
-    if "All" in types_val:
-        types_val=[]
-    
-    ####Size deactived for the time being.
-    emission_fig=emissions_map(ghg_t,resol,fr=date_fr,to=date_to,lat=lat,lon=lon,zoom=zoom,type_vessel=types_val,size=[])
-        
-    return emission_fig 
-
-###Month and type update on map
-@app.callback(
-     Output("month_map", "children"),
-    [ Input('year_slider', 'value'),
-      ],
-)
-
-def month_map(date):
-    fr=(pd.to_datetime("12-01-2018 00:00")+relativedelta(months=+date[0]))
-    to=(pd.to_datetime("12-01-2018 00:00")+relativedelta(months=+date[1]))
-    
-    m_fr=datetime.strptime(str(fr.month), "%m").strftime("%b")
-    m_to=datetime.strptime(str(to.month), "%m").strftime("%b")
-
-    
-    m_e="{} {} to {} {}".format(m_fr,fr.year,m_to,to.year)
-    
-    return m_e
-    
-##Refresh button
-@app.callback([Output("ports-dropdown", "value"),
-               Output("types-dropdown","value"),
-               Output('year_slider', 'value'),
-               Output('size_slider', 'value')],
-              [Input('refresh-button', 'n_clicks')])     
-
-def clearMap(n_clicks):
-    if n_clicks !=0:
-        pdd=["All"]
-        tdd=["All"]
-        ysld=[0,20]
-        ssld=[400,170000]
-        return pdd,tdd,ysld,ssld
-    
-if __name__ == "__main__":
-    app.run_server(debug=True,use_reloader=False)
-
+
+'''
+Author:Gabriel Fuentes
+gabriel.fuentes@snf.no'''
+
+# Import required libraries
+import collections
+import copy
+import hashlib
+import json
+import pathlib
+import hmac
+import logging
+import threading
+import time
+import dash
+import flask
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
+import dash_core_components as dcc
+import dash_html_components as html
+import plotly.graph_objects as go
+from dateutil.relativedelta import *
+from datetime import datetime
+
+from controls import TYPE_COLORS,PORTS_COLORS,FLEET,GT_MIN,GT_MAX,GT_STEP,GT_MARKS
+
+##DataFrames. pandas, numpy and the modules built on them are imported by the functions
+##that use them, importing the app takes dash alone.
+import datasets
+from cache import LRUCache, FigureCache, SingleFlight, cache_stats, flight_stats
+import os
+
+##Load time reports, frame memory among them
+logging.basicConfig(level=os.environ.get("LOG_LEVEL","INFO"))
+##Dash gives the logger named after this module a handler of its own, records sent there
+##would also reach the root handler and show twice
+log=logging.getLogger("dashboard")
+
+##Databases are loaded on first use or by datasets.warm, see datasets.py
+def read_slider(data=None):
+    """
+    Date slider in months from its start, and the last Gatun date, of the loaded datasets.
+    The defaults until they are in, the layout is built per request and picks them up then.
+    """
+    return (data is not None and data.slider) or (datetime(2018,12,1),20,datetime(2020,11,18))
+
+SLIDER_START,SLIDER_MONTHS,GATUN_END=read_slider(datasets.get() if datasets.ready() else None)
+
+@datasets.on_load
+def slider_loaded(data):
+    global SLIDER_START,SLIDER_MONTHS,GATUN_END
+    SLIDER_START,SLIDER_MONTHS,GATUN_END=read_slider(data)
+
+##Filtered port/canal events of the port graphs. The upper row reads the day rollups of
+##rollups.KpiRollup instead and never reaches this cache.
+events_cache=LRUCache("events",max_entries=int(os.environ.get("EVENTS_CACHE_ENTRIES",32)),
+                      max_bytes=int(os.environ.get("EVENTS_CACHE_MB",128))*2**20,
+                      ttl=int(os.environ.get("EVENTS_CACHE_TTL",3600)))
+
+##Waiting/service histograms per filter, binned on the server. HIST_BINS is fixed (1 hour) or fd.
+HIST_BINS=os.environ.get("HIST_BINS","fixed")
+histogram_cache=LRUCache("histograms",max_entries=256,max_bytes=16*2**20)
+##Identical updates arriving together, as every visitor of a shared link on the default
+##selection, wait for one computation. Keys carry the data version or signature.
+summary_flight=SingleFlight("summary")
+graphs_flight=SingleFlight("port_graphs")
+gatun_flight=SingleFlight("gatun")
+emissions_flight=SingleFlight("emissions")
+
+##Figures per selection and datasets signature, in process and in a disk tier shared by the
+##workers under FIGURE_CACHE_DIR when diskcache is installed. FIGURE_CACHE_DIR= turns it off.
+figure_tier=None
+if os.environ.get("FIGURE_CACHE_DIR","cache/figures"):
+    try:
+        import diskcache
+        figure_tier=diskcache.Cache(os.environ.get("FIGURE_CACHE_DIR","cache/figures"),
+                                    size_limit=int(os.environ.get("FIGURE_DISK_MB",512))*2**20,
+                                    eviction_policy="least-recently-used")
+    except ImportError:
+        pass
+
+##Modules whose code shapes the figures, the loading, store and caching of the data they
+##are built from included. Figures a previous deploy left in the disk tier are keyed on
+##another hash of them, never read and left to expire.
+FIGURE_MODULES=["app.py","choropleth_map_emission.py","hexagons.py","rollups.py",
+                "bitmap_index.py","data_filtering.py","controls.py",
+                "datasets.py","store.py","snapshot.py","cache.py"]
+
+def figure_version(modules=FIGURE_MODULES):
+    """
+    Hash of the source of the modules that build the figures.
+    """
+    h=hashlib.sha1()
+    for module in modules:
+        with open(pathlib.Path(__file__).parent.joinpath(module),"rb") as f:
+            h.update(f.read())
+    
+    return h.hexdigest()[:16]
+
+FIGURE_VERSION=figure_version()
+
+def figure_cache(name,flight,max_entries,max_mb):
+    return FigureCache(name,shared=figure_tier,version=FIGURE_VERSION,flight=flight,
+                       max_entries=max_entries,max_bytes=max_mb*2**20,
+                       ttl=int(os.environ.get("FIGURE_CACHE_TTL",3600)))
+
+graphs_cache=figure_cache("port_graphs",graphs_flight,128,64)
+gatun_cache=figure_cache("gatun",gatun_flight,64,16)
+emissions_cache=figure_cache("emissions",emissions_flight,64,128)
+##Map geometry per grid size and datasets signature, see emissions_geometry
+geometry_cache=figure_cache("geometry",None,16,64)
+
+@datasets.on_swap
+def reloaded(data):
+    ##Entries of the previous version are never hit again, free them now
+    for cache in (events_cache,histogram_cache,graphs_cache,gatun_cache,emissions_cache,geometry_cache):
+        cache.clear()
+    warm_figures()
+
+##Filter selections made in this worker, approximate counts, see /popular-states. Past
+##SELECTIONS_MAX keys only the SELECTIONS_MAX//2 most common are kept, see count_selection.
+selections=collections.Counter()
+SELECTIONS_MAX=int(os.environ.get("SELECTIONS_MAX",1000))
+
+##Figures built by warm_figures once the datasets are in. WARM_STATES names a json file of
+##selections to warm after the default one, as /popular-states lists them.
+WARM_FIGURES=os.environ.get("WARM_FIGURES","1")!="0"
+WARM_STATES=os.environ.get("WARM_STATES")
+##Values of the zoom_slider
+GRID_SIZES=[4,5,6,7,8]
+warm_report={}
+
+##BACKGROUND_CALLBACKS=1 runs the heavy callbacks as background jobs when diskcache is installed,
+##see background. Each job is a process forked for the call, it shares only the disk tiers:
+##the in-process caches and single flights of the worker are not reused. Off by default.
+background_manager=None
+if os.environ.get("BACKGROUND_CALLBACKS","0")=="1":
+    try:
+        import diskcache
+        ##Results are cached on disk per inputs and datasets signature, shared by the workers
+        background_manager=dash.DiskcacheManager(diskcache.Cache(os.environ.get("BACKGROUND_CACHE_DIR","cache/background")),
+                                                 cache_by=[lambda: datasets.get().signature],
+                                                 expire=int(os.environ.get("BACKGROUND_CACHE_TTL",3600)))
+    except ImportError:
+        log.warning("diskcache not installed, callbacks run in the request")
+
+def background(*running):
+    """
+    Callback keyword arguments that run it as a background job, with the running
+    (output, value while running, value when done) states. The renderer cancels the job of a
+    request superseded by a newer one from the same page. Empty without a manager.
+    """
+    if background_manager is None:
+        return {}
+    
+    return dict(background=True,manager=background_manager,running=list(running))
+
+##Dimmed while a background job computes the figure
+RUNNING_STYLE=({"opacity":0.5},{"opacity":1})
+
+##Held by the warm thread for each state it warms. A background job forked meanwhile waits for
+##the state to finish, so it never starts with the locks the warm thread held.
+warm_lock=threading.Lock()
+if background_manager is not None and hasattr(os,"register_at_fork"):
+    os.register_at_fork(before=warm_lock.acquire,after_in_parent=warm_lock.release,
+                        after_in_child=warm_lock.release)
+
+##Token of the admin routes, they are off when ADMIN_TOKEN is not set
+ADMIN_TOKEN=os.environ.get("ADMIN_TOKEN")
+
+# get relative data folder
+PATH = pathlib.Path(__file__).parent
+DATA_PATH = PATH.joinpath("data").resolve()
+
+app = dash.Dash(
+    __name__, meta_tags=[{"name": "viewport", "content": "width=device-width"}]
+)
+
+app.title = 'Panama Maritime Stats'
+
+server = app.server
+
+@server.route("/healthz")
+def healthz_route():
+    ##Answers while the datasets load, datasets tells whether they are in
+    return flask.jsonify({"status":"ok","datasets":"ready" if datasets.ready() else "loading",
+                          "warm":warm_report or None})
+
+def admin_only():
+    """
+    Abort with 403 unless the X-Admin-Token header matches ADMIN_TOKEN.
+    """
+    token=flask.request.headers.get("X-Admin-Token","")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token,ADMIN_TOKEN):
+        flask.abort(403)
+
+@server.route("/admin/reload",methods=["POST"])
+def reload_route():
+    ##Reloads this worker only, DATA_WATCH_SECONDS makes every worker watch the inputs
+    admin_only()
+    datasets.reload_async()
+    return flask.jsonify({"status":"reloading","version":datasets.get().version if datasets.ready() else None}),202
+
+##Cache keys and user selections, admin only as well
+@server.route("/cache-stats")
+def cache_stats_route():
+    admin_only()
+    return flask.jsonify(cache_stats())
+
+@server.route("/popular-states")
+def popular_states_route():
+    admin_only()
+    return flask.jsonify(popular_states(int(flask.request.args.get("n",20))))
+
+@server.route("/flight-stats")
+def flight_stats_route():
+    admin_only()
+    return flask.jsonify(flight_stats())
+
+# Create global chart template
+
+MAPBOX_TOKEN = os.environ.get('MAPBOX_TOKEN', None)
+
+##Streamed map: geometry sent once per grid size, filter changes only send locations and z.
+##MAP_STREAMING=0 goes back to a full figure per update.
+MAP_STREAMING = os.environ.get('MAP_STREAMING', '1') != '0'
+
+layout_map = dict(
+    autosize=True,
+    paper_bgcolor='#30333D',
+    plot_bgcolor='#30333D',
+    margin=dict(l=10, r=10, b=10, t=10),
+    hovermode="closest",
+    font=dict(family="HelveticaNeue",size=17,color="#B2B2B2"),
+    legend=dict(font=dict(size=10), orientation="h"),
+    mapbox=dict(
+        accesstoken=MAPBOX_TOKEN,
+        style='mapbox://styles/gabrielfuenmar/ckhs87tuj2rd41amvifhb26ad',
+        center=dict(lon=-79.55, lat=8.93),
+        zoom=9,
+    ),
+    showlegend=False,
+)
+
+layout= dict(
+    legend=dict(bgcolor='rgba(0,0,0,0)',font=dict(size=14,family="HelveticaNeue")),
+    font_family="HelveticaNeue",
+    font_color="#B2B2B2",
+    title_font_family="HelveticaNeue",
+    title_font_color="#B2B2B2",
+    title_font_size=20,
+    paper_bgcolor='#21252C',
+    plot_bgcolor='#21252C',
+    xaxis=dict(gridcolor="rgba(178, 178, 178, 0.1)",title_font_size=15,
+               tickfont_size=14,title_font_family="HelveticaNeue",tickfont_family="HelveticaNeue"),
+    yaxis=dict(gridcolor="rgba(178, 178, 178, 0.1)",title_font_size=15,tickfont_size=14,
+               title_font_family="HelveticaNeue",tickfont_family="HelveticaNeue")
+    )
+
+##Modebar on graphs
+config={"displaylogo":False, 'modeBarButtonsToRemove': ['autoScale2d']}
+
+
+##Annotation on graphs
+annotation_layout=dict(
+    xref="x domain",
+    yref="y domain",
+    x=0.25,
+    y=-0.35)
+
+def slider_marks(step=5):
+    """
+    Month labels every step months of the date slider, and at its end.
+    """
+    months=sorted(set(range(0,SLIDER_MONTHS+1,step))|{SLIDER_MONTHS})
+    
+    return {m:(SLIDER_START+relativedelta(months=+m)).strftime("%b %Y") for m in months}
+
+def port_options():
+    """
+    Port dropdown entries from the loaded ports, or from the ports of PORTS_COLORS while loading.
+    """
+    canal_ports=["Panama Canal South", "Panama Canal North"]
+    if datasets.ready():
+        ports=datasets.get().ports
+        names=ports[~ports.port_name.isin(["Pacific - PATSA","Colon2000"])].dropna(subset=["port_name"]).port_name.unique()
+    else:
+        names=[name for name in PORTS_COLORS if name not in canal_ports]
+    
+    return [{'label': row,'value': row} for row in sorted(names)+canal_ports]
+
+# Create app layout
+def serve_layout():
+    """
+    Page layout, built per page load so it never waits for the datasets, see port_options.
+    """
+    return html.Div(
+        [
+            dcc.Store(id="aggregate_data"),
+            # empty Div to trigger javascript file for graph resizing
+            html.Div(id="output-clientside"),
+            html.Div(
+                [
+                    html.Div(
+                        [
+                            html.A(html.Img(
+                                src=app.get_asset_url("mtcc_logo_v3.png"),
+                                id="plotly-image",
+                                style={
+                                    "height": "160px",
+                                    "width": "auto",
+                                    "margin-bottom": "0px",
+                                    "text-align": "center"
+                                },
+                            ),
+                                href="https://mtcclatinamerica.com/")
+                        ],
+                        className="one-half column",
+                    ),
+                    html.Div(
+                        [
+                            html.Div(
+                                [
+                                    html.H3(
+                                        "Panama Maritime Statistics",
+                                        style={"margin-bottom": "0px"},
+                                    ),
+                                    html.H5(
+                                        "Efficiency and Sustainability Indicators", style={"margin-top": "0px"}
+                                    ),
+                                ]
+                            )
+                        ],
+                        className="one-half column",
+                        id="title",
+                    ),
+                    html.Div(
+                        [
+                            html.Button("Refresh", id="refresh-button"), 
+                            html.A(
+                                html.Button("Developer", id="home-button"),
+                                href="https://gabrielfuentes.org",
+                            )                  
+                        ],
+                        className="one-third column",
+                        id="button",
+                        style={
+                            "text-align": "center"},
+                    ),
+                ],
+                id="header",
+                className="row flex-display",
+                style={"margin-bottom": "15px"},
+            ),
+            html.Div(
+                [
+                    html.Div(
+                        [
+                          html.P("Date Filter",
+                                        className="control_label",
+                                    ),
+                                    html.Div([html.P(id="date_from"),
+                                    html.P(id="date_to")],className="datecontainer")
+                                ,
+                            dcc.RangeSlider(
+                                id="year_slider",
+                                min=0,
+                                max=SLIDER_MONTHS,
+                                value=[0, SLIDER_MONTHS],
+                                marks=slider_marks(),
+                                allowCross=False,
+                                className="dcc_control",
+                            ),
+                            html.P("Vessel Type:", className="control_label"),
+                            dcc.Dropdown(
+                                id='types-dropdown',
+                                options=[{'label': row,'value': row} \
+                                         for row in sorted(FLEET)],
+                                        placeholder="All",multi=True,
+                                        className="dcc_control"),
+                            html.P("Port:", className="control_label"),
+                            dcc.Dropdown(
+                                id='ports-dropdown',
+                                options=port_options(),
+                                        placeholder="All",multi=True,
+                                        className="dcc_control"),
+                            html.P(
+                                "Vessel Size (GT)",
+                                className="control_label",
+                            ),
+                            html.Div([html.P(id="size_from"),
+                                    html.P(id="size_to")],className="datecontainer"),
+                        
+                            dcc.RangeSlider(
+                                id="size_slider",
+                                min=GT_MIN,
+                                max=GT_MAX,
+                                value=[GT_MIN, GT_MAX],
+                                step=GT_STEP,
+                                marks=GT_MARKS,
+                                allowCross=False,
+                                className="dcc_control",
+                            ),
+                        ],
+                        className="pretty_container four columns",
+                        id="cross-filter-options",
+                    ),
+                    html.Div(
+                        [
+                            html.Div(
+                                [
+                                    html.Div(
+                                        [html.H6(id="waitingText"), html.P("Waiting Average")],
+                                        id="waiting",
+                                        className="mini_container",
+                                    ),
+                                    html.Div(
+                                        [html.H6(id="opsText"), html.P("Operations")],
+                                        id="ops",
+                                        className="mini_container",
+                                    ),
+                                    html.Div(
+                                        [html.H6(id="serviceText"), html.P("Service Average")],
+                                        id="service_m",
+                                        className="mini_container",
+                                    ),
+                                    html.Div(#####Hardcoded for the time being. Build a scrapper.
+                                        [html.H6(["15.24 m"],id="draughtText"), html.P("Canal Max Draught TFW")],
+                                        id="draught",
+                                        className="mini_container",
+                                    ),
+                                ],
+                                id="info-container",
+                                className="row container-display",
+                            ),
+                            html.Div([
+                                html.Div(
+                                        [
+                                            html.Div([html.H5("Emissions Review"),
+                                                      html.H6(id="month_map",style={"color":"white"})],
+                                                                style={"display": "flex", "flex-direction": "row","justify-content":"space-between"}),
+                                            dcc.Graph(animate=False,config=config,id="map_in"),
+                                            dcc.Store(id="map_geometry"),
+                                            dcc.Store(id="map_values"),
+                                                 html.P(["Grid size"],id="grid_size",className="control_label"),
+                                                             dcc.Slider(
+                                                             id="zoom_slider",
+                                                             min=4,
+                                                             max=8,
+                                                             value=8,
+                                                             marks={4:{'label': '1'},5:{'label': '2'},6:{'label': '3'},
+                                                                7:{'label': '4'},8:{'label': '5'}},
+                                                             className="dcc_control",
+                                                             included=False),
+                                                                 dcc.RadioItems(
+                                                                 id='selector',options=[{'label': "CO2 emissions", 'value': "co2"},
+                                                                                        {'label': "CH4 emissions", 'value': "ch4"}],
+                                                                 value="co2",labelStyle={'display': 'inline-block'}),
+                                               ],
+                                    id="emissionsMapContainer",
+                                    className="pretty_container eight columns",
+                                    )
+                                ],
+                                className="row flex-display",
+                                ),
+                            ],
+                        id="right-column",
+                        className="eight columns",
+                    ),
+                ],
+                className="row flex-display",
+            ),
+            html.Div(
+                [
+                    html.Div(
+                        [dcc.Graph(id="service_graph",config=config)],
+                        className="pretty_container six columns",
+                    ),
+                    html.Div(
+                        [dcc.Graph(id="waiting_graph",config=config)],
+                        className="pretty_container six columns",
+                    )
+                ],
+                className="row flex-display",
+            ),
+            html.Div(
+                [
+                    html.Div(
+                        [dcc.Graph(id="draught_graph",config=config)],
+                        className="pretty_container six columns",
+                    ),
+                    html.Div(
+                        [dcc.Graph(id="ratio_graph",config=config)],
+                        className="pretty_container six columns",
+                    ),
+                ],
+                className="row flex-display",
+            ),
+        ],
+        id="mainContainer",
+        style={"display": "flex", "flex-direction": "column"},
+    )
+
+app.layout = serve_layout
+
+    
+def filter_key(fr,to,ports_sel,type_vessel,size):
+    """
+    Normalized filter tuple, equal for every spelling of the same selection.
+    """
+    import pandas as pd
+    
+    date_from=pd.to_datetime(fr)
+    date_to=pd.to_datetime(to)
+    ports_key=None if "All" in ports_sel else tuple(sorted(set(ports_sel)))
+    types_key=None if "All" in type_vessel else tuple(sorted(set(type_vessel)))
+    size_key=None if "All" in size else (float(size[0]),float(size[1]))
+    
+    return date_from,date_to,ports_key,types_key,size_key
+
+def filtered_events(data,key):
+    """
+    Port calls and direct canal transits of data within the filter_key filters, one row per event.
+    Cached in events_cache per data version, callers must not modify it.
+    """
+    return events_cache.get_or_compute((data.version,key),lambda: build_filtered_events(data,*key))
+
+def build_filtered_events(data,date_from,date_to,ports_key,types_key,size_key):
+    from data_filtering import time_bounds
+    
+    lo,hi=time_bounds(data.events,"time",date_from,date_to)
+    keep=data.events_index.select(lo,hi,port_name=ports_key,StandardVesselType=types_key,gt=size_key)
+    
+    return data.events.iloc[lo:hi][keep]
+
+def trimmed_by_port(df_in,column,floor):
+    """
+    Ports with more than 25 readings of column and, for each, the readings above floor
+    strictly inside the port 5%-95% quantiles.
+    """
+    from data_filtering import quantile_mask
+    
+    counts=df_in.groupby("port_name",observed=True)[column].count()
+    labels=counts[counts>25].index.tolist()
+    
+    keep=quantile_mask(df_in,"port_name",[column],0.05,0.95,inclusive=False)&(df_in[column]>floor)
+    trimmed=dict((name,row.tolist()) for name,row in df_in[keep].groupby("port_name",observed=True)[column])
+    
+    return labels,[trimmed.get(name,[]) for name in labels]
+
+def density_histogram(values,bins=HIST_BINS,size=1.0):
+    """
+    Bin edges and probability densities of values. "fixed" bins are size hours wide from the
+    minimum, as figure_factory drew them, "fd" uses Freedman-Diaconis widths.
+    """
+    import numpy as np
+    
+    values=np.asarray(values,dtype=float)
+    if len(values)==0:
+        return np.array([]),np.array([])
+    
+    if bins=="fd":
+        edges=np.histogram_bin_edges(values,bins="fd")
+    else:
+        edges=values.min()+size*np.arange(int((values.max()-values.min())//size)+2)
+    density,edges=np.histogram(values,bins=edges,density=True)
+    
+    return edges,density
+
+def port_histograms(data,key,df_in,column,floor):
+    """
+    Ports and their binned, trimmed readings of column for the filter key, see trimmed_by_port.
+    Binned once per key and data version in histogram_cache, only edges and densities reach the figure.
+    """
+    def build():
+        labels,values=trimmed_by_port(df_in,column,floor)
+        return labels,[density_histogram(v) for v in values]
+    
+    return histogram_cache.get_or_compute((data.version,key,column),build)
+
+def histogram_figure(labels,histograms):
+    """
+    Overlaid density bars, one trace per port, in place of figure_factory's distplot.
+    """
+    import numpy as np
+    
+    colors=list(PORTS_COLORS.values())
+    fig=go.Figure()
+    for i,(label,(edges,density)) in enumerate(zip(labels,histograms)):
+        fig.add_trace(go.Bar(name=label,legendgroup=label,
+                             x=((edges[:-1]+edges[1:])/2).round(4),y=density.round(6),width=np.diff(edges).round(4),
+                             marker_color=colors[i%len(colors)]))
+    fig.update_layout(barmode="overlay",bargap=0,legend_traceorder="reversed",xaxis_zeroline=False)
+    
+    return fig
+
+def upper_text_p1(fr="01-01-2019",to="18-11-2020",ports_sel=["All"],
+                type_vessel=["All"],size=["All"],text_bar=True,*args):
+    
+    ##One datasets version for the whole update, a reload may swap them meanwhile
+    data=datasets.get()
+    key=filter_key(fr,to,ports_sel,type_vessel,size)
+    
+    if text_bar is True: ##Row at top with summary values, looked up in the day rollups
+        return summary_flight.do((data.version,key),lambda: data.kpi.summary(*key))
+    
+    else: ###Graphs on waiting, service time and draught ratio
+        return graphs_cache.get_or_compute((data.signature,key),lambda: port_graphs(data,key))
+
+def port_graphs(data,key):
+    """
+    Waiting time, service time and draught ratio figures for a filter_key selection.
+    """
+    import pandas as pd
+    
+    df_in=filtered_events(data,key)
+    
+    ##Fig ratio, weekly means from the draught rollup
+    df_in=df_in[df_in.day>pd.to_datetime("01-01-2019")]
+    df_in=df_in.reset_index(drop=True)
+    since=pd.to_datetime("01-01-2019")+pd.Timedelta(days=1)
+    series_grouped=data.draught.weekly(max(key[0],since),*key[1:])
+    
+    draught_fig = go.Figure()
+    
+    for val in series_grouped["StandardVesselType"].unique():
+        series_in=series_grouped[series_grouped["StandardVesselType"]==val]
+        draught_fig.add_trace(go.Scatter(
+            name=val,
+            mode="markers+lines",
+            x=series_in.day,y=series_in.draught_ratio,
+            line=dict(shape="spline", width=1, color=TYPE_COLORS[val]),
+            marker=dict(symbol="diamond-open")))
+    
+    
+    draught_fig.update_layout(layout,legend=dict(x=1),title_text="<b>Draught Ratio per vessel type</b>",
+                              xaxis=dict(title_text="Date"),yaxis=dict(title_text="Ratio"),)
+    draught_fig.add_annotation(annotation_layout,text="*AIS draft/min(maxTFWD, max Allowable draft)")
+    ##Service and waiting time
+    labels_w,waiting=port_histograms(data,key,df_in,"waiting_time",1)
+    labels_s,service=port_histograms(data,key,df_in,"service_time",0)
+         
+    ##Figs of waiting and service time
+    
+    if len(labels_w)>0:
+        fig_waiting = histogram_figure(labels_w,waiting)
+        
+    else:
+        fig_waiting=go.Figure()
+        fig_waiting.add_annotation(x=2,y=5,xref="x",yref="y",text="max=5",showarrow=True,
+        font=dict(family="Courier New, monospace",size=16, color="#ffffff"),align="center",
+        arrowhead=2, arrowsize=1, arrowwidth=2,arrowcolor="#636363", ax=20,ay=-30,bordercolor="#c7c7c7",
+        borderwidth=2,borderpad=4,bgcolor="#ff7f0e",opacity=0.8)
+    
+    if len(labels_s)>0:
+        fig_service = histogram_figure(labels_s,service)
+    else:
+        fig_service=go.Figure()
+        fig_service.add_annotation(x=2,y=5,xref="x",yref="y",text="max=5",showarrow=True,
+        font=dict(family="Courier New, monospace",size=16, color="#ffffff"),align="center",
+        arrowhead=2, arrowsize=1, arrowwidth=2,arrowcolor="#636363", ax=20,ay=-30,bordercolor="#c7c7c7",
+        borderwidth=2,borderpad=4,bgcolor="#ff7f0e",opacity=0.8)
+    
+    
+    ###Service and Waiting Graphs Layout
+    fig_waiting.update_layout(layout,yaxis=dict(zeroline=True,linecolor='white',title_text="Density"),
+                              xaxis=dict(title_text="Hours"),
+                              legend=dict(x=0.6),title_text="<b>Waiting Time</b>")
+    fig_waiting.add_annotation(annotation_layout,text="*Results from inbuilt method by Fuentes, Sanchez-Galan and Diaz")
+    fig_waiting.update_traces(marker_line_color='rgb(8,48,107)',
+                              marker_line_width=1.5, opacity=0.6)
+    fig_service.update_layout(layout,yaxis=dict(zeroline=True,linecolor="white",title_text="Density"),
+                              xaxis=dict(title_text="Hours"),
+                              legend=dict(x=0.6),title_text="<b>Service Time</b>")
+    fig_service.add_annotation(annotation_layout,text="*Results from inbuilt method by Fuentes, Sanchez-Galan and Diaz")
+    fig_service.update_traces(marker_line_color='rgb(8,48,107)',
+                              marker_line_width=1.5, opacity=0.6)
+    
+    
+    return fig_waiting,fig_service,draught_fig
+    
+def lake_draught(fr="01-01-2015",to="18-11-2020",*args):
+    import pandas as pd
+    
+    date_from=pd.to_datetime(fr)
+    date_to=pd.to_datetime(to)
+    
+    data=datasets.get()
+    
+    return gatun_cache.get_or_compute((data.signature,date_from,date_to),lambda: gatun_figure(data.gatun_rows(date_from,date_to),date_from,date_to))
+
+def gatun_figure(gatun,date_from,date_to):
+    """
+    Gatun lake depth and draught restriction figure within the inclusive dates.
+    """
+    from plotly.subplots import make_subplots
+    from data_filtering import time_slice
+    
+    gatun_in=time_slice(gatun,"Date",date_from,date_to)
+    gatun_in=gatun_in.assign(day=gatun_in.Date.dt.day.astype(str)+"/"+gatun_in.Date.dt.month.astype(str)+"/"+gatun_in.Date.dt.year.astype(str))
+    lake_fig=make_subplots(specs=[[{"secondary_y": True}]])
+    lake_fig.add_trace(go.Scatter(
+                name="Gatun Lake Depth",
+                mode="lines",
+                x=gatun_in.day,y=gatun_in.gatun_depth,
+                line=dict(shape="spline", width=2,color="#6671FD")),secondary_y=True)
+    
+    lake_fig.add_trace(go.Scatter(
+                name="Draught Change",
+                mode="lines",
+                x=gatun_in[gatun_in.Change.notnull()]["day"],y=gatun_in[gatun_in.Change.notnull()]["Change"],
+                line=dict(shape="spline", width=2,color="#3ACC95"),
+                marker=dict(symbol="diamond-open")),secondary_y=False)
+    
+    lake_fig.add_trace(go.Scatter(
+                name="Max draught",
+                mode="lines",
+                x=gatun_in.day,y=gatun_in.Overall,
+                line=dict(shape="spline", width=2,color="#F9A054")),secondary_y=False)
+    
+    ##Layout update  
+    lake_fig.update_layout(layout,title_text="<b>Gatun Lake and Draught Restriction Relation</b>",
+                           xaxis=dict(title_text="Date",nticks=6),
+                           legend=dict(x=0.6,y=1))
+    
+    # Set y-axes titles
+    lake_fig.update_yaxes(title_text="Max Draught (m)", secondary_y=False,showgrid=False,
+                          range=[gatun_in.Overall.min()*0.99,gatun_in.Overall.max()*1.05])
+    lake_fig.update_yaxes(title_text="Lake Depth (m)", secondary_y=True,gridcolor="rgba(178, 178, 178, 0.1)",
+                          title_font_size=15,tickfont_size=14,
+                          title_font_family="HelveticaNeue",tickfont_family="HelveticaNeue",
+                          range=[gatun_in.gatun_depth.min()*0.99,gatun_in.gatun_depth.max()*1.05])
+    lake_fig.add_annotation(annotation_layout,text="*Values sourced by the Panama Canal Authority Maritime Services Platform")
+    return lake_fig
+    
+def map_layout(lat=None,lon=None,zoom=None):
+    """
+    Copy of layout_map for one request, centered on lat, lon at zoom when given.
+    Shared layouts are never modified by a callback, which keeps them safe for threaded workers.
+    """
+    layout_in=copy.deepcopy(layout_map)
+    if lat is not None:
+        layout_in["mapbox"].update(center=dict(lon=lon,lat=lat),zoom=zoom)
+    
+    return layout_in
+
+def emissions_key(ghg,res,fr,to,type_vessel,size):
+    """
+    Normalized map selection, equal for every spelling of the same selection.
+    """
+    import pandas as pd
+    
+    return ghg,res,pd.to_datetime(fr),pd.to_datetime(to),tuple(sorted(set(type_vessel))),tuple(size)
+
+def emissions_map(ghg,res,fr="01-01-2018",to="30-08-2020",lat=None,lon=None,zoom=None,type_vessel=[],size=[]):
+    
+    data=datasets.get()
+    key=("map",data.signature,emissions_key(ghg,res,fr,to,type_vessel,size),lat,lon,zoom)
+    
+    return emissions_cache.get_or_compute(key,lambda: emissions_figure(data,ghg,res,fr,to,lat,lon,zoom,type_vessel,size))
+
+def emissions_figure(data,ghg,res,fr,to,lat,lon,zoom,type_vessel,size):
+    import pandas as pd
+    from choropleth_map_emission import choropleth_map, sum_by_hexagon
+    
+    date_fr=pd.to_datetime(fr)
+    date_to=pd.to_datetime(to)
+    
+    df_aggreg=sum_by_hexagon(data.em,res,data.pol,date_fr,date_to,vessel_type=type_vessel,gt=size,cube=data.em_cube)
+    
+    
+    ##Layout of this request only, layout_map is shared by every request
+    layout_in=map_layout(lat,lon,zoom)
+        
+    if df_aggreg.shape[0]>0:
+        heatmap=choropleth_map(ghg,df_aggreg,layout_in)
+    else:
+        heatmap=go.Figure(data=go.Scattermapbox(lat=[0],lon=[0]),layout=layout_in)
+
+    return heatmap
+
+def emissions_geometry(res):
+    """
+    Map trace holding the geometry of every hexagon at resolution res, plus a layout that
+    keeps the user viewport between updates. Sent to the browser once per grid size and
+    data version.
+    """
+    data=datasets.get()
+    
+    def build():
+        from choropleth_map_emission import choropleth_trace
+        
+        trace=choropleth_trace(data.em_geojson[res]).to_plotly_json()
+        
+        return {"res":res,"version":data.signature,"trace":trace,"layout":dict(map_layout(),uirevision="emissions")}
+    
+    return geometry_cache.get_or_compute((data.signature,res),build)
+
+def emissions_values(ghg,res,fr="01-01-2018",to="30-08-2020",type_vessel=[],size=[]):
+    """
+    Locations and z of the map for the filters, patched into the trace in the browser.
+    """
+    data=datasets.get()
+    
+    def build():
+        import pandas as pd
+        from choropleth_map_emission import choropleth_values, sum_by_hexagon
+        
+        date_fr=pd.to_datetime(fr)
+        date_to=pd.to_datetime(to)
+        df_aggreg=sum_by_hexagon(data.em,res,data.pol,date_fr,date_to,vessel_type=type_vessel,gt=size,cube=data.em_cube)
+        locations,z=choropleth_values(ghg,df_aggreg)
+        
+        return {"res":res,"version":data.signature,"locations":locations,"z":z}
+    
+    return emissions_cache.get_or_compute(("values",data.signature,emissions_key(ghg,res,fr,to,type_vessel,size)),build)
+
+def slider_dates(date):
+    """
+    First day of the first month and last day of the last month selected on the date slider.
+    """
+    date_fr=SLIDER_START+relativedelta(months=+date[0])
+    date_to=SLIDER_START+relativedelta(months=+date[1])+relativedelta(day=31)
+    
+    return date_fr,date_to
+
+def map_dates(date):
+    ##The map runs one month after the slider months
+    date_fr=SLIDER_START+relativedelta(months=+date[0]+1)
+    date_to=SLIDER_START+relativedelta(months=+date[1]+1)
+    date_to=date_to+ relativedelta(day=31)
+    
+    return date_fr,date_to
+
+##Upper Row,
+@app.callback(
+    [
+        Output("waitingText", "children"),
+        Output("opsText", "children"),
+        Output("serviceText", "children"),
+        Output("date_from","children"),
+        Output("date_to","children"),
+        Output("size_from","children"),
+        Output("size_to","children"),
+    ],
+    [Input("ports-dropdown", "value"),
+     Input("types-dropdown","value"),
+     Input('year_slider', 'value'),
+     Input('size_slider', 'value'),
+     ],
+)
+def update_row1(ports_val,types_val,date,size_val):
+    if not ports_val:
+        ports_val=["All"]
+    if not types_val:
+        types_val=["All"]
+    
+    ##Requests only, warm_figures calls this too
+    if flask.has_request_context():
+        count_selection(ports_val,types_val,date,size_val)
+    
+    date_fr,date_to=slider_dates(date)
+    
+    if date[0]==0:
+        date_fr=SLIDER_START+relativedelta(months=+1,days=-1)
+    
+    date_fr=date_fr.strftime('%d-%m-%Y')
+    date_to=date_to.strftime('%d-%m-%Y')
+    
+    waiting,ops,service=upper_text_p1(fr=date_fr,to=date_to,ports_sel=ports_val,type_vessel=types_val,size=size_val)
+    
+    return "{:.1f}".format(waiting)+ " hours", format(ops,","), "{:.1f}".format(service) + " hours",\
+        date_fr, date_to ,format(size_val[0],","),format(size_val[1],",")
+    
+
+@app.callback(
+    [
+        Output("service_graph", "figure"),
+        Output("waiting_graph", "figure"),
+        Output("ratio_graph", "figure"),
+
+    ],
+    [Input("ports-dropdown", "value"),
+      Input("types-dropdown","value"),
+      Input('year_slider', 'value'),
+      Input('size_slider', 'value'),
+      ],
+    **background((Output("service_graph","style"),)+RUNNING_STYLE,
+                 (Output("waiting_graph","style"),)+RUNNING_STYLE,
+                 (Output("ratio_graph","style"),)+RUNNING_STYLE),
+)
+
+
+def update_graphs(ports_val,types_val,date,size_val):
+    if not ports_val:
+        ports_val=["All"]
+    if not types_val:
+        types_val=["All"]
+  
+    date_fr,date_to=slider_dates(date)
+    
+    if date[0]==0:
+        date_fr=SLIDER_START+relativedelta(months=+1,days=-1)
+    
+    date_fr=date_fr.strftime('%d-%m-%Y')
+    date_to=date_to.strftime('%d-%m-%Y')
+    
+    service_g,waiting_g,ratio_g=upper_text_p1(fr=date_fr,to=date_to,ports_sel=ports_val,type_vessel=types_val,size=size_val,text_bar=False)
+    
+    return service_g,waiting_g,ratio_g
+
+@app.callback(
+    Output("draught_graph", "figure"),
+    [ Input('year_slider', 'value'),
+      ],
+)
+
+def update_gatun(date):
+
+    date_fr,date_to=slider_dates(date)
+    
+    if date[0]==0:
+        date_fr=SLIDER_START+relativedelta(months=+1,days=-2)
+    
+    if date[1]==SLIDER_MONTHS and GATUN_END is not None:
+        date_to=GATUN_END
+        
+    lake_g=lake_draught(fr=date_fr,to=date_to)
+    
+    return lake_g
+
+if MAP_STREAMING:
+    @app.callback(
+        Output("map_geometry", "data"),
+        [Input("zoom_slider","value"),
+         Input("map_values", "data"),
+          ],
+        [State("map_geometry", "data")],
+    )
+    
+    def update_map_geometry(resol,values,geometry):
+        ##Fetched on a new grid size, and again once values come from reloaded data
+        if geometry and geometry["res"]==resol and (not values or values["version"]==geometry["version"]):
+            raise PreventUpdate
+        return emissions_geometry(resol)
+    
+    @app.callback(
+        Output("map_values", "data"),
+        [Input("selector","value"),
+         Input("zoom_slider","value"),
+         Input('year_slider', 'value'),
+         Input("types-dropdown","value"),
+          ],
+        **background((Output("map_in","style"),)+RUNNING_STYLE),
+    )
+    
+    def update_emissions_map(ghg_t,resol,date,types_val):
+        
+        date_fr,date_to=map_dates(date)
+        
+        if "All" in types_val:
+            types_val=[]
+        
+        ####Size deactived for the time being.
+        return emissions_values(ghg_t,resol,fr=date_fr,to=date_to,type_vessel=types_val,size=[])
+    
+    app.clientside_callback(
+        ClientsideFunction(namespace="clientside", function_name="emissions_map"),
+        Output("map_in", "figure"),
+        [Input("map_values", "data"),
+         Input("map_geometry", "data")],
+    )
+
+else:
+    @app.callback(
+        Output("map_in", "figure"),
+        [Input("selector","value"),
+         Input("zoom_slider","value"),
+         Input('year_slider', 'value'),
+         Input("types-dropdown","value"),
+          ],
+        [State("map_in","relayoutData")],
+        **background((Output("map_in","style"),)+RUNNING_STYLE),
+    )
+    
+    def update_emissions_map(ghg_t,resol,date,types_val,relay):
+        
+        date_fr,date_to=map_dates(date)
+        
+        if relay is not None:   
+            if "mapbox.center" in relay.keys():
+                lat=relay["mapbox.center"]["lat"]
+                lon=relay["mapbox.center"]["lon"]
+                zoom=relay["mapbox.zoom"]
+            else:
+                lat=8.93
+                lon=-79.55
+                zoom=9
+        else:
+            lat=8.93
+            lon=-79.55
+            zoom=9
+        
+        if "All" in types_val:
+            types_val=[]
+        
+        ####Size deactived for the time being.
+        emission_fig=emissions_map(ghg_t,resol,fr=date_fr,to=date_to,lat=lat,lon=lon,zoom=zoom,type_vessel=types_val,size=[])
+            
+        return emission_fig 
+
+###Month and type update on map
+@app.callback(
+     Output("month_map", "children"),
+    [ Input('year_slider', 'value'),
+      ],
+)
+
+def month_map(date):
+    fr=SLIDER_START+relativedelta(months=+date[0])
+    to=SLIDER_START+relativedelta(months=+date[1])
+    
+    m_fr=datetime.strptime(str(fr.month), "%m").strftime("%b")
+    m_to=datetime.strptime(str(to.month), "%m").strftime("%b")
+
+    
+    m_e="{} {} to {} {}".format(m_fr,fr.year,m_to,to.year)
+    
+    return m_e
+    
+##Refresh button
+@app.callback([Output("ports-dropdown", "value"),
+               Output("types-dropdown","value"),
+               Output('year_slider', 'value'),
+               Output('size_slider', 'value')],
+              [Input('refresh-button', 'n_clicks')])     
+
+def clearMap(n_clicks):
+    if n_clicks !=0:
+        pdd=["All"]
+        tdd=["All"]
+        ysld=[0,SLIDER_MONTHS]
+        ssld=[GT_MIN,GT_MAX]
+        return pdd,tdd,ysld,ssld
+    
+def valid_range(values,low,high,kinds):
+    """
+    True for a [from,to] pair of the given kinds with low<=from<=to<=high.
+    """
+    return isinstance(values,list) and len(values)==2 and \
+        all(isinstance(v,kinds) and not isinstance(v,bool) for v in values) and low<=values[0]<=values[1]<=high
+
+def count_selection(ports_val,types_val,date,size_val):
+    """
+    Count a selection for popular_states when every value is one the controls offer,
+    the counter keys come from the client. Trims the counter past SELECTIONS_MAX keys.
+    """
+    ports=set(option["value"] for option in port_options())|{"All"}
+    types=set(FLEET)|{"All"}
+    if not (isinstance(ports_val,list) and all(isinstance(p,str) and p in ports for p in ports_val) and
+            isinstance(types_val,list) and all(isinstance(t,str) and t in types for t in types_val) and
+            valid_range(date,0,SLIDER_MONTHS,int) and valid_range(size_val,GT_MIN,GT_MAX,(int,float))):
+        return
+    
+    selections[(tuple(sorted(ports_val)),tuple(sorted(types_val)),tuple(date),tuple(size_val))]+=1
+    if len(selections)>SELECTIONS_MAX:
+        kept=selections.most_common(SELECTIONS_MAX//2)
+        selections.clear()
+        selections.update(dict(kept))
+
+def popular_states(n=20):
+    """
+    The n selections made most often in this worker, most frequent first, in the format
+    of the WARM_STATES file. Counts are not shared between workers, each one counts the
+    selections it answered since it started.
+    """
+    return [{"ports":list(ports),"types":list(types),"date":list(date),"size":list(size),"count":count}
+            for (ports,types,date,size),count in selections.most_common(n)]
+
+def warm_states():
+    """
+    Default selection of the dashboard, then the selections of the WARM_STATES file.
+    """
+    states=[{"ports":["All"],"types":["All"],"date":[0,SLIDER_MONTHS],"size":[GT_MIN,GT_MAX]}]
+    if WARM_STATES:
+        try:
+            with open(WARM_STATES) as f:
+                states+=json.load(f)
+        except (OSError,ValueError):
+            log.warning("Cannot read the warm states in %s",WARM_STATES)
+    
+    return states
+
+def warm_state(state):
+    """
+    Run the callbacks of one selection: summary row, port graphs, Gatun chart and the
+    emissions map at every grid size, geometry included, all keeping their results in the caches.
+    """
+    ports=state.get("ports",["All"])
+    types=state.get("types",["All"])
+    date=state.get("date",[0,SLIDER_MONTHS])
+    size=state.get("size",[GT_MIN,GT_MAX])
+    
+    update_row1(ports,types,date,size)
+    update_graphs(ports,types,date,size)
+    update_gatun(date)
+    for res in state.get("grids",GRID_SIZES):
+        map_inputs=(state.get("ghg","co2"),res,date,types)
+        if MAP_STREAMING:
+            update_emissions_map(*map_inputs)
+            emissions_geometry(res)
+        else:
+            update_emissions_map(*map_inputs,None)
+
+def warm_figures():
+    """
+    Build the figures of warm_states in a daemon thread once the datasets are in, so the
+    first visitors after a start or reload hit the caches. WARM_FIGURES=0 turns it off.
+    The time taken is logged and reported by /healthz.
+    """
+    if not WARM_FIGURES:
+        return None
+    
+    def run():
+        data=datasets.get()
+        started=time.monotonic()
+        warmed=0
+        for state in warm_states():
+            try:
+                with warm_lock:
+                    warm_state(state)
+                warmed+=1
+            except Exception:
+                log.exception("Warming %s failed",state)
+        seconds=time.monotonic()-started
+        warm_report.update(version=data.version,states=warmed,seconds=round(seconds,2))
+        log.info("Warmed %d dashboard states of datasets version %d in %.1f s",warmed,data.version,seconds)
+    
+    thread=threading.Thread(target=run,name="figures-warm",daemon=True)
+    thread.start()
+    return thread
+
+if __name__ == "__main__":
+    datasets.warm()
+    datasets.watch()
+    warm_figures()
+    app.run_server(debug=True,use_reloader=False)
+
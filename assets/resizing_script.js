@@ -1,13 +1,25 @@
-if (!window.dash_clientside) {
-  window.dash_clientside = {};
-}
-window.dash_clientside.clientside = {
-  resize: function(value) {
-    console.log("resizing..."); // for testing
-    setTimeout(function() {
-      window.dispatchEvent(new Event("resize"));
-      console.log("fired resize");
-    }, 500);
-    return null;
-  }
-};
+if (!window.dash_clientside) {
+  window.dash_clientside = {};
+}
+window.dash_clientside.clientside = {
+  resize: function(value) {
+    console.log("resizing..."); // for testing
+    setTimeout(function() {
+      window.dispatchEvent(new Event("resize"));
+      console.log("fired resize");
+    }, 500);
+    return null;
+  },
+  emissions_map: function(values, geometry) {
+    // Geometry comes once per grid size and data version, values on every filter change.
+    // Wait until both belong to the same grid size and data, then patch locations and z in.
+    if (!values || !geometry || values.res !== geometry.res || values.version !== geometry.version) {
+      return window.dash_clientside.no_update;
+    }
+    var trace = Object.assign({}, geometry.trace, {
+      locations: values.locations,
+      z: values.z
+    });
+    return {data: [trace], layout: geometry.layout};
+  }
+};
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Bitmap indexes for the low cardinality filters: port, vessel type and GT.
+
+One boolean array per category value and per GT bucket is built at load time.
+A filter is then an OR over the selected values and an AND across columns,
+restricted to the row window returned by time_bounds.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def gt_codes(gt, edges):
+    """
+    GT bucket code of every value against the sorted slider edges.
+    2i is a value equal to edges[i], 2i+1 a value strictly between edges[i] and
+    edges[i+1], -1 below the first edge, 2*len(edges)-1 above the last, -2 NaN.
+    A slider range [edges[i],edges[j]] is then exactly the codes 2i to 2j.
+    """
+    gt = np.asarray(gt, dtype=float)
+    edges = np.asarray(edges, dtype=float)
+    pos = np.minimum(edges.searchsorted(gt, side="left"), len(edges) - 1)
+    exact = edges[pos] == gt
+    after = gt > edges[pos]
+    codes = np.where(exact, 2 * pos, np.where(after, 2 * pos + 1, 2 * pos - 1))
+    return np.where(np.isnan(gt), -2, codes)
+
+
+def gt_bucket_bounds(code, edges):
+    """
+    Interval (lo, hi, lo_open, hi_open) covered by a GT bucket code.
+    """
+    n = len(edges)
+    if code == -1:
+        return -np.inf, edges[0], True, True
+    if code == 2 * n - 1:
+        return edges[-1], np.inf, True, True
+    if code % 2 == 0:
+        return edges[code // 2], edges[code // 2], False, False
+    return edges[code // 2], edges[code // 2 + 1], True, True
+
+
+def gt_range_codes(gt_range, edges):
+    """
+    Bucket codes lying fully inside the inclusive range, and the codes it only
+    partly covers, which need an exact comparison on the rows.
+    """
+    lo, hi = gt_range
+    full, partial = [], []
+    for code in range(-1, 2 * len(edges)):
+        b_lo, b_hi, lo_open, hi_open = gt_bucket_bounds(code, edges)
+        if b_hi < lo or b_lo > hi or (b_hi == lo and hi_open) or (b_lo == hi and lo_open):
+            continue
+        if b_lo >= lo and b_hi <= hi:
+            full.append(code)
+        else:
+            partial.append(code)
+    return full, partial
+
+
+class BitmapIndex:
+    """
+    Boolean array per value of each indexed column, plus per GT bucket when a GT
+    column is given. Rows follow the frame order, so a time window (lo, hi) is a
+    slice of every bitmap.
+
+    Ex index=BitmapIndex(events,["port_name","StandardVesselType"],gt="GT",gt_edges=GT_EDGES)
+       mask=index.select(lo,hi,port_name=["MIT"],gt=(400,35000))
+    """
+
+    def __init__(self, df, columns, gt=None, gt_edges=None):
+        self.rows = len(df)
+        self.bitmaps = {}
+        for column in columns:
+            codes, values = pd.factorize(df[column])
+            self.bitmaps[column] = {value: codes == k for k, value in enumerate(values)}
+
+        self.gt_edges = gt_edges
+        self.gt_bitmaps = {}
+        if gt is not None:
+            self.gt_values = df[gt].to_numpy(dtype=float)
+            codes = gt_codes(self.gt_values, gt_edges)
+            self.gt_bitmaps = {int(code): codes == code for code in np.unique(codes) if code != -2}
+
+    def _any(self, bitmaps, keys, lo, hi):
+        mask = np.zeros(hi - lo, dtype=bool)
+        for key in keys:
+            bitmap = bitmaps.get(key)
+            if bitmap is not None:
+                mask |= bitmap[lo:hi]
+        return mask
+
+    def select(self, lo=0, hi=None, gt=None, **filters):
+        """
+        Boolean mask over rows lo:hi. Each keyword names an indexed column and
+        the accepted values, None keeps every row. gt is an inclusive (min, max).
+        """
+        hi = self.rows if hi is None else hi
+        mask = np.ones(hi - lo, dtype=bool)
+        for column, values in filters.items():
+            if values is not None:
+                mask &= self._any(self.bitmaps[column], values, lo, hi)
+
+        if gt is not None:
+            full, partial = gt_range_codes(gt, self.gt_edges)
+            in_range = self._any(self.gt_bitmaps, full, lo, hi)
+            if partial:
+                ##Exact comparison only on rows of the edge buckets
+                edge = self._any(self.gt_bitmaps, partial, lo, hi) & mask
+                values = self.gt_values[lo:hi][edge]
+                in_range[edge] = (values >= gt[0]) & (values <= gt[1])
+            mask &= in_range
+
+        return mask
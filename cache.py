@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+In-process result caches shared by the callbacks, and single-flight groups
+that let concurrent identical computations run once without keeping results.
+FigureCache adds an optional tier shared by processes, such as a diskcache.Cache.
+
+Every cache and named group registers itself by name so its counts can be read
+from one place, see cache_stats and flight_stats.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+CACHES = {}
+FLIGHTS = {}
+
+
+def sizeof(value):
+    """
+    Approximate bytes held by a cached value. Frames count their column buffers,
+    tuples and lists add up their items.
+    """
+    if hasattr(value, "memory_usage"):
+        usage = value.memory_usage(index=True)
+        return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class SingleFlight:
+    """
+    Runs one computation per key at a time. Callers asking for a key while it is being
+    computed wait and share its result, or its exception. Nothing is kept afterwards.
+    Named groups register in FLIGHTS.
+
+    Ex figures=SingleFlight("figures"); figures.do(key,lambda: build(key))
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self.computed = 0
+        self.coalesced = 0
+        self.failed = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+        if name is not None:
+            FLIGHTS[name] = self
+
+    def do(self, key, compute):
+        with self._lock:
+            call = self._calls.get(key)
+            owner = call is None
+            if owner:
+                call = self._calls[key] = {"done": threading.Event()}
+                self.computed += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            call["done"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = compute()
+            return call["result"]
+        except BaseException as error:
+            call["error"] = error
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+    def stats(self):
+        with self._lock:
+            return {"computed": self.computed, "coalesced": self.coalesced,
+                    "failed": self.failed, "in_flight": len(self._calls)}
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+
+class LRUCache:
+    """
+    Least recently used cache bounded by entries and bytes, with a time to live.
+    Concurrent misses on the same key run the computation once through a
+    SingleFlight, the other callers wait for its result.
+
+    Ex frames=LRUCache("frames",max_entries=32); frames.get_or_compute(key,lambda: build(key))
+    """
+
+    def __init__(self, name, max_entries=64, max_bytes=256 * 2**20, ttl=3600, flight=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._flight = flight or SingleFlight()
+        self._lock = threading.Lock()
+        CACHES[name] = self
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value[0]
+
+        def fill():
+            with self._lock:
+                ##Stored by a computation that finished since the lookup above
+                value = self._lookup(key)
+                if value is not None:
+                    self.hits += 1
+                    return value[0]
+                self.misses += 1
+            result = compute()
+            with self._lock:
+                self._store(key, result)
+            return result
+
+        return self._flight.do(key, fill)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, size, stamp = entry
+        if self.ttl is not None and time.monotonic() - stamp > self.ttl:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return (value,)
+
+    def _store(self, key, value):
+        size = sizeof(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (value, size, time.monotonic())
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        value, size, stamp = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "coalesced": self._flight.coalesced,
+                    "entries": len(self._entries), "bytes": self._bytes}
+
+
+class Decoded:
+    """
+    Value decoded from its JSON, sized by the length of that JSON.
+    """
+    __slots__ = ("value", "nbytes")
+
+    def __init__(self, payload):
+        self.value = json.loads(payload)
+        self.nbytes = len(payload)
+
+
+class FigureCache(LRUCache):
+    """
+    LRUCache of figures, or any value Dash can send, kept as their JSON decoded to plain
+    dicts and lists, so a hit skips building Plotly objects. Each value is serialized once.
+    With a shared tier, any object with get(key) and set(key,value,expire=) such as a
+    diskcache.Cache, a miss reads the JSON another process stored there before computing.
+    Keys must name the data they derive from, the shared tier outlives reloads. version names
+    the code that builds the values, entries of other versions in the shared tier are not read.
+
+    Ex figures=FigureCache("maps",shared=diskcache.Cache("cache/figures"),version=code_hash)
+       figures.get_or_compute((data.signature,key),lambda: build(key))
+    """
+
+    def __init__(self, name, shared=None, version=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.shared = shared
+        self.version = version
+        self.shared_hits = 0
+
+    def get_or_compute(self, key, compute):
+        return super().get_or_compute(key, lambda: self._fill(key, compute)).value
+
+    def _fill(self, key, compute):
+        ##Dash serializes responses with the same encoder
+        from plotly.io.json import to_json_plotly
+
+        shared_key = (self.name, self.version) + tuple(key)
+        payload = self.shared.get(shared_key) if self.shared is not None else None
+        if payload is not None:
+            with self._lock:
+                self.shared_hits += 1
+            return Decoded(payload)
+
+        payload = to_json_plotly(compute())
+        if self.shared is not None:
+            self.shared.set(shared_key, payload, expire=self.ttl)
+        return Decoded(payload)
+
+    def stats(self):
+        stats = super().stats()
+        stats["shared_hits"] = self.shared_hits
+        return stats
+
+
+def cache_stats():
+    """
+    Hit and miss counts of every registered cache, by name.
+    """
+    return {name: cache.stats() for name, cache in CACHES.items()}
+
+
+def flight_stats():
+    """
+    Computed and coalesced call counts of every named single-flight group, by name.
+    """
+    return {name: flight.stats() for name, flight in FLIGHTS.items()}
+
+
+def _after_fork():
+    ##A forked child has only the forking thread. Locks and pending computations of the
+    ##other threads of the parent would never be released there.
+    for cache in CACHES.values():
+        cache._lock = threading.Lock()
+        cache._flight._after_fork()
+    for flight in FLIGHTS.values():
+        flight._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -1,125 +1,171 @@
-import pandas as pd
-import h3
-import json
-from geojson.feature import *
-import plotly.graph_objs as go
-import geopandas as gpd
-from shapely import wkt
-
-
-def list_of_valid_hex(gdf,reso):
-    
-    exp=[]
-    for polygon in gdf.geometry:
-        # Convert Polygon to GeoJSON dictionary
-        poly_geojson = gpd.GeoSeries([polygon]).__geo_interface__
-        # Parse out geometry key from GeoJSON dictionary
-        poly_geojson = poly_geojson['features'][0]['geometry'] 
-        # Fill the dictionary with Resolution 10 H3 Hexagons
-
-        h3_hexes = h3.polyfill_geojson(poly_geojson, reso)
-        exp.append(h3_hexes)
-    exp=list(set().union(*exp))
-    
-    return exp
-
-def sum_by_hexagon(df,resolution,pol,fr,to,vessel_type=[],gt=[]):
-    """
-    Use h3.geo_to_h3 to index each data point into the spatial index of the specified resolution.
-    Use h3.h3_to_geo_boundary to obtain the geometries of these hexagons
-    
-    Ex counts_by_hexagon(data, 8)
-    """
-    
-    if vessel_type:
-        df_aggreg=df[((df.dt_pos_utc.between(fr,to))&(df.StandardVesselType.isin(vessel_type)))]
-    else:
-        df_aggreg=df[df.dt_pos_utc.between(fr,to)]
-    if df_aggreg.shape[0]>0:        
-        if gt:
-            df_aggreg=df_aggreg[df_aggreg.GrossTonnage.between(gt[0],gt[1])]
-    
-        if resolution==8:
-            df_aggreg = df_aggreg.groupby(by = "res_8").agg({"co2_t":sum,"ch4_t":sum}).reset_index()
-        else:
-            df_aggreg = df_aggreg.assign(new_res=df_aggreg.res_8.apply(lambda x: h3.h3_to_parent(x,resolution)))
-            df_aggreg = df_aggreg.groupby(by = "new_res").agg({"co2_t":sum,"ch4_t":sum}).reset_index()
-            
-        df_aggreg.columns = ["hex_id", "co2_t","ch4_t"]
-            
-        df_aggreg["geometry"] =  df_aggreg.hex_id.apply(lambda x: 
-                                                                {    "type" : "Polygon",
-                                                                      "coordinates": 
-                                                                    [h3.h3_to_geo_boundary(x,geo_json=True)]
-                                                                }
-                                                            )
-        
-        return df_aggreg
-    else:
-        return df_aggreg
-
-def hexagons_dataframe_to_geojson(df_hex, file_output = None):
-    """
-    Produce the GeoJSON for a dataframe that has a geometry column in geojson 
-    format already, along with the columns hex_id and value
-    
-    Ex counts_by_hexagon(data)
-    """    
-   
-    list_features = []
-    
-    for i,row in df_hex.iterrows():
-        feature = Feature(geometry = row["geometry"] , id=row["hex_id"], properties = {"value" : row["value"]})
-        list_features.append(feature)
-        
-    feat_collection = FeatureCollection(list_features)
-    
-    geojson_result = json.dumps(feat_collection)
-    
-    #optionally write to file
-    if file_output is not None:
-        with open(file_output,"w") as f:
-            json.dump(feat_collection,f)
-    
-    return geojson_result 
-
-
-def choropleth_map(ghg, df_aggreg,layout_in,fill_opacity = 0.5):
-    
-    """
-    Creates choropleth maps given the aggregated data.
-    """    
-    
-    if ghg=="co2":
-        ghg="co2_t"
-    elif ghg=="ch4":
-        ghg="ch4_t"
-    else:
-        ValueError ("Enter ch4 or co2")
-    
-    df_aggreg.rename(columns={ghg:"value"},inplace=True)   
-    #colormap
-    min_value = df_aggreg["value"].min()
-    max_value = df_aggreg["value"].max()
-    m = round ((min_value + max_value ) / 2 , 0)
-    
-    #take resolution from the first row
-    res = h3.h3_get_resolution(df_aggreg.loc[0,'hex_id'])
-    
-    #create geojson data from dataframe
-    geojson_data = json.loads(hexagons_dataframe_to_geojson(df_hex = df_aggreg))
-    
-    ##plot on map
-    initial_map=go.Choroplethmapbox(geojson=geojson_data,
-                                    locations=df_aggreg.hex_id.tolist(),
-                                    z=df_aggreg["value"].round(2).tolist(),
-                                    colorscale="balance",
-                                    marker_opacity=fill_opacity,
-                                    marker_line_width=1,
-                                    colorbar = dict(thickness=20, ticklen=3,title="tonnes"),
-                                    hovertemplate = '%{z:,.2f}<extra></extra>')
-    
-    initial_map=go.Figure(data=initial_map,layout=layout_in)
-    
-    return initial_map
-    
+import pandas as pd
+import h3
+import json
+from geojson.feature import *
+import plotly.graph_objs as go
+
+from bitmap_index import BitmapIndex, gt_range_codes
+from controls import GT_EDGES
+from data_filtering import NO_TYPE, time_bounds
+from hexagons import h3_parent, int_to_h3, hex_feature, hex_collection
+
+
+def list_of_valid_hex(gdf,reso):
+    import geopandas as gpd
+    
+    exp=[]
+    for polygon in gdf.geometry:
+        # Convert Polygon to GeoJSON dictionary
+        poly_geojson = gpd.GeoSeries([polygon]).__geo_interface__
+        # Parse out geometry key from GeoJSON dictionary
+        poly_geojson = poly_geojson['features'][0]['geometry'] 
+        # Fill the dictionary with Resolution 10 H3 Hexagons
+
+        h3_hexes = h3.polyfill_geojson(poly_geojson, reso)
+        exp.append(h3_hexes)
+    exp=list(set().union(*exp))
+    
+    return exp
+
+def emissions_cube(df,resolutions=[4,5,6,7,8],gt_edges=GT_EDGES):
+    """
+    Pre-aggregate the emissions into summed co2_t and ch4_t per month, vessel type, GT bucket
+    and hexagon for every map resolution. df holds the resolution 8 sums of
+    data_filtering.read_emissions. Built once at load time, map requests then slice and sum it.
+    Hexagons stay as uint64 cells, see hexagons.py. Each resolution holds its cells sorted
+    by month and a bitmap index on vessel type and GT bucket. Rows without a vessel type are
+    kept as NO_TYPE, which no type filter selects.
+    
+    Ex cube=emissions_cube(em); cube[6]["cells"]
+    """
+    types=df.StandardVesselType
+    if hasattr(types,"cat") and NO_TYPE not in types.cat.categories:
+        types=types.cat.add_categories([NO_TYPE])
+    df=df.assign(StandardVesselType=types.fillna(NO_TYPE))
+    
+    cube={}
+    for resolution in resolutions:
+        hexes=h3_parent(df.res_8.to_numpy(),resolution)
+        cells=df.assign(hex_id=hexes).groupby(["dt_pos_utc","StandardVesselType","gt_code","hex_id"],observed=True)[["co2_t","ch4_t"]].sum()
+        cells=cells.reset_index().sort_values("dt_pos_utc",kind="mergesort").reset_index(drop=True)
+        cube[resolution]={"cells":cells,"index":BitmapIndex(cells,["StandardVesselType","gt_code"]),
+                          "gt_edges":gt_edges}
+    
+    return cube
+
+def emissions_geojson(cube):
+    """
+    Ready-made FeatureCollection of every hexagon in the cube, one per resolution.
+    Building it also fills the boundary cache, so no map request computes a boundary.
+    """
+    return {resolution:hex_collection(int_to_h3(level["cells"].hex_id.unique())) for resolution,level in cube.items()}
+
+def sum_by_hexagon(df,resolution,pol,fr,to,vessel_type=[],gt=[],cube=None):
+    """
+    Use h3.geo_to_h3 to index each data point into the spatial index of the specified resolution.
+    Geometries are not attached, they come from the cached features in hexagons.py.
+    
+    Sums come from the pre-aggregated cells of a cube from emissions_cube, built from df when
+    no cube is given. gt is matched on the GT buckets of the cube, a range off the bucket edges
+    takes in the whole buckets it touches. The size slider only stops on the edges.
+    
+    Ex counts_by_hexagon(data, 8)
+    """
+    if cube is None:
+        cube=emissions_cube(df,[resolution])
+    
+    level=cube[resolution]
+    cells=level["cells"]
+    lo,hi=time_bounds(cells,"dt_pos_utc",fr,to)
+    codes=None
+    if gt:
+        full,partial=gt_range_codes(gt,level["gt_edges"])
+        codes=full+partial
+    if vessel_type or codes is not None:
+        cells=cells.iloc[lo:hi][level["index"].select(lo,hi,StandardVesselType=vessel_type or None,gt_code=codes)]
+    else:
+        cells=cells.iloc[lo:hi]
+    if cells.shape[0]==0:
+        return cells
+    
+    df_aggreg=cells.groupby(by="hex_id").agg({"co2_t":sum,"ch4_t":sum}).reset_index()
+    df_aggreg["hex_id"]=int_to_h3(df_aggreg.hex_id)
+    
+    return df_aggreg
+
+def hexagons_dataframe_to_geojson(df_hex, file_output = None):
+    """
+    Produce the GeoJSON FeatureCollection for a dataframe with the columns hex_id and value.
+    Boundaries come from the per cell cache in hexagons.py.
+    
+    Ex hexagons_dataframe_to_geojson(df_aggreg,"hexagons.geojson")
+    """    
+   
+    list_features = [Feature(geometry = hex_feature(hex_id)["geometry"], id=hex_id, properties = {"value" : value})
+                     for hex_id,value in zip(df_hex["hex_id"],df_hex["value"])]
+        
+    feat_collection = FeatureCollection(list_features)
+    
+    #optionally write to file
+    if file_output is not None:
+        with open(file_output,"w") as f:
+            json.dump(feat_collection,f)
+    
+    return feat_collection 
+
+
+def choropleth_trace(geojson,fill_opacity = 0.5):
+    """
+    Choroplethmapbox trace with the map styling and geometry but no values.
+    Shared by the full figure and the streamed map, which fills locations and z in the browser.
+    """
+    return go.Choroplethmapbox(geojson=geojson,
+                               colorscale="balance",
+                               marker_opacity=fill_opacity,
+                               marker_line_width=1,
+                               colorbar = dict(thickness=20, ticklen=3,title="tonnes"),
+                               hovertemplate = '%{z:,.2f}<extra></extra>')
+
+def choropleth_values(ghg, df_aggreg):
+    """
+    Hexagon ids and rounded values of the selected gas, all the streamed map needs per update.
+    """
+    if df_aggreg.shape[0]==0:
+        return [],[]
+    
+    ghg={"co2":"co2_t","ch4":"ch4_t"}[ghg]
+    
+    return df_aggreg.hex_id.tolist(),df_aggreg[ghg].round(2).tolist()
+
+def choropleth_map(ghg, df_aggreg,layout_in,fill_opacity = 0.5,geojson=None):
+    
+    """
+    Creates choropleth maps given the aggregated data.
+    Without geojson the collection holds the cached features of the cells in df_aggreg only,
+    which keeps the figure smaller than a whole resolution from emissions_geojson.
+    Neither df_aggreg nor layout_in are modified.
+    """    
+    
+    if ghg=="co2":
+        ghg="co2_t"
+    elif ghg=="ch4":
+        ghg="ch4_t"
+    else:
+        ValueError ("Enter ch4 or co2")
+    
+    ##df_aggreg may be shared, read the column instead of renaming it
+    values = df_aggreg[ghg]
+    
+    #geometry only, values go in z
+    if geojson is None:
+        geojson = hex_collection(df_aggreg.hex_id)
+    
+    ##plot on map
+    initial_map=choropleth_trace(geojson,fill_opacity)
+    initial_map.update(locations=df_aggreg.hex_id.tolist(),
+                       z=values.round(2).tolist())
+    
+    initial_map=go.Figure(data=initial_map,layout=layout_in)
+    
+    return initial_map
+    
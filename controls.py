@@ -1,30 +1,38 @@
-#Controls for APP
-
-TYPE_COLORS = {
-    "Yacht":"#FFEDA0",
-    "Cruise":"#FA9FB5",
-    "Ferry-pax only":"#A1D99B",
-    "General cargo":"#67BD65",
-    "Oil tanker":"#BFD3E6",
-    "Ferry-RoPax":"#B3DE69",
-    "Bulk carrier":"#FDBF6F",
-    "Refrigerated bulk":"#FC9272",
-    "Ro-Ro":"#D0D1E6",
-    "Chemical tanker":"#ABD9E9",
-    "Vehicle":"#3690C0",
-    "Container":"#FFFFFF",
-    "Liquified gas tanker":"#D96C06",
-    "Other liquids tankers":"#544B3D"
-}
-PORTS_COLORS={
-    "Panama Canal South":"#6671fD",
-    "Panama Canal North":"#9ECAE1",
-    "Pacific - PSA":"#A867FD",
-    "Pacific - PPC Balboa":"#E85335",
-    "MIT":"#3ACC95",
-    "CCT":"#F9A054",
-    "Atlantic - PPC Cristobal":"#207F23",
-    }
-
-FLEET=['Yacht',  'Cruise', 'Ferry-pax only',  'General cargo', 'Oil tanker','Ferry-RoPax', 'Bulk carrier', 
-      'Refrigerated bulk', 'Ro-Ro','Chemical tanker', 'Vehicle','Container', 'Liquified gas tanker', 'Other liquids tankers']
+#Controls for APP
+
+TYPE_COLORS = {
+    "Yacht":"#FFEDA0",
+    "Cruise":"#FA9FB5",
+    "Ferry-pax only":"#A1D99B",
+    "General cargo":"#67BD65",
+    "Oil tanker":"#BFD3E6",
+    "Ferry-RoPax":"#B3DE69",
+    "Bulk carrier":"#FDBF6F",
+    "Refrigerated bulk":"#FC9272",
+    "Ro-Ro":"#D0D1E6",
+    "Chemical tanker":"#ABD9E9",
+    "Vehicle":"#3690C0",
+    "Container":"#FFFFFF",
+    "Liquified gas tanker":"#D96C06",
+    "Other liquids tankers":"#544B3D"
+}
+PORTS_COLORS={
+    "Panama Canal South":"#6671fD",
+    "Panama Canal North":"#9ECAE1",
+    "Pacific - PSA":"#A867FD",
+    "Pacific - PPC Balboa":"#E85335",
+    "MIT":"#3ACC95",
+    "CCT":"#F9A054",
+    "Atlantic - PPC Cristobal":"#207F23",
+    }
+
+FLEET=['Yacht',  'Cruise', 'Ferry-pax only',  'General cargo', 'Oil tanker','Ferry-RoPax', 'Bulk carrier', 
+      'Refrigerated bulk', 'Ro-Ro','Chemical tanker', 'Vehicle','Container', 'Liquified gas tanker', 'Other liquids tankers']
+
+##Vessel size slider (GT). It stops on the steps and on the marks, all of them edges of the
+##GT bitmap buckets, so any range picked on it is summed exactly.
+GT_MIN=400
+GT_MAX=170000
+GT_STEP=8500
+GT_MARKS={400:"400",35000:"35k",70000:"70k",105000:"105k",140000:"140k",170000:"170k"}
+GT_EDGES=sorted(set(range(GT_MIN,GT_MAX,GT_STEP))|set(GT_MARKS)|{GT_MAX})
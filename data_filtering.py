@@ -1,81 +1,339 @@
-# -*- coding: utf-8 -*-
-"""
-Created on Fri Nov 13 10:24:39 2020
-
-@author: gabri
-"""
-
-import pandas as pd
-import numpy as np
-
-def processed_data(FLEET):
-    ##Ports info adjust and filtering.
-    df=pd.read_csv("data/ports_solutions_sp.csv")
-    
-    ##Less than 30 mins as this is the minimum number of positions to have a. Then kalman didnt work. Fix kalman to avoid this.
-    ##Some didnt go thorugh kalman and have a faulty reading.
-    df["waiting_time"]=np.where(df.waiting_time<0.5,np.nan,df.waiting_time)
-    df["waiting_time"]=np.where(df.waiting_time>150,150,df.waiting_time)
-    
-    
-    ##Remove potential bunkering ops, Non in Telfer. 
-    ###There is no oil operations inside Canal other than bunkering supplied.
-    ###Need to refine to identify bunkering in Patsa from loading ops
-    df=df[~(df["Fleet Type"]=="Product Tankers")&(df["port_name"]!="Telfer")]
-    
-    ##Containers not in PATSA in PSA and Types adjustments
-    df["Fleet Type"]=np.where(df.vessel_type_main=="Container Ship","Containerships",df["Fleet Type"])
-    df["Fleet Type"]=np.where(df["Fleet Type"]=="PCC","Ro-Ro",df["Fleet Type"])
-    df["port_name"]=np.where(df["Fleet Type"]=="Containerships",np.where(df["port_name"]=="Pacific - PATSA",
-                              "Pacific - PSA",df["port_name"]),df["port_name"])
-    
-    ##Nan replacements when possible
-    df["Fleet Type"]=np.where(df["Fleet Type"].isnull(),
-                              np.where(df.vessel_type_main!="None",df.vessel_type_main,df["Fleet Type"]),
-                                        df["Fleet Type"])
-    
-    ##Types fix
-    
-    df["Fleet Type"]=np.where(df["Fleet Type"].isin(["Offshore","Offshore Support Vessel"]),"Offshore Vessel",df["Fleet Type"])
-    
-    df["Fleet Type"]=np.where(df["Fleet Type"].isin(["MPP","General Cargo Ship"]),"General Cargo",df["Fleet Type"])
-    
-    df["Fleet Type"]=np.where(df["Fleet Type"].isin(["Oil And Chemical Tanker","Chemical Tankers"]),"Other Tanker",df["Fleet Type"])
-    
-    df["Fleet Type"]=np.where(df["Fleet Type"].isin(["Cruise"]),"Passenger Ship",df["Fleet Type"])
-    
-    df["Fleet Type"]=np.where(df["Fleet Type"].isin(["Bulkers"]),"Bulk Carrier",df["Fleet Type"])
-    
-    df["Fleet Type"]=np.where(df["Fleet Type"].isin(["Fishing Vessel","Pleasure Craft","Service Ship","Cable Layer"]),
-                              "Others",df["Fleet Type"])
-    
-    df=df[df["Fleet Type"].notnull()]
-    
-    ###As I dont recognize the servicing vessel, I will just keep containers, ro-ro and passagner. FOR THE MOMENT
-    
-    df=df[df["Fleet Type"].isin(["Containerships","Ro-Ro","Passenger Ship"])]
-    
-    ##Quantiles on service and waiting times to remove outliers. 10% winzorization
-    ##Direct visit from after lockage.
-    grouped_df=df.groupby("port_name")
-    df=grouped_df.apply(lambda x: x[(x.waiting_time.isnull())|((x["service_time"]>=x["service_time"].quantile(0.05))&
-                                    (x["service_time"]<=x["service_time"].quantile(0.95))&
-                                    (x["waiting_time"]>=x["waiting_time"].quantile(0.05))&
-                                    (x["waiting_time"]<=x["waiting_time"].quantile(0.95))&
-                                    (x.waiting_time.notnull()))]).reset_index(drop=True)
-    waiting=df.groupby("port_name").waiting_time.describe()
-    
-    service=df.groupby("port_name").service_time.describe()
-    
-    ###Panama Info. Next time, rescue types from AIS reading
-    
-    canal=pd.read_csv("data/panama_transits_sp.csv")
-    canal=canal[canal["StandardVesselType"].isin(FLEET)]
-    
-    
-    ##Errors in values
-    return canal,df
-
-
-
-
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Nov 13 10:24:39 2020
+
+@author: gabri
+"""
+
+import importlib
+import logging
+from collections import namedtuple
+
+import pandas as pd
+import numpy as np
+
+from bitmap_index import gt_codes
+from controls import GT_EDGES
+from hexagons import h3_to_int
+from snapshot import snapshot_key, load_snapshot, save_snapshot
+
+##Declared schema per dataset. Only columns are read, keep are held after cleaning,
+##dates parsed, category and float32 applied once the cleaning is done. Times and draught
+##ratios stay float64, the charts take their means and quantiles per request.
+SCHEMAS={"ports":{"path":"data/ports_solutions_sp.csv",
+                  "columns":["initial_service","service_time","waiting_time","port_name","GT",
+                             "vessel_type_main","Fleet Type","draught_ratio","StandardVesselType"],
+                  "keep":["initial_service","service_time","waiting_time","port_name","GT",
+                          "Fleet Type","draught_ratio","StandardVesselType"],
+                  "dates":["initial_service"],
+                  "category":["port_name","StandardVesselType","Fleet Type"],
+                  "float32":["GT"]},
+         "canal":{"path":"data/panama_transits_sp.csv",
+                  "columns":["time_at_entrance","direct_transit_boolean","waiting_time","service_time",
+                             "port_name","draught_ratio","StandardVesselType","GT"],
+                  "dates":["time_at_entrance"],
+                  "category":["port_name","StandardVesselType"],
+                  "float32":["GT"]},
+         "gatun":{"path":"data/draught_restr_data.csv",
+                  "columns":["Date","Overall","Change","gatun_depth"],
+                  "dates":["Date"],
+                  "category":[],
+                  "float32":["Overall","Change","gatun_depth"]},
+         "em":{"path":"data/emissions_type_monthly.csv",
+               "columns":["dt_pos_utc","StandardVesselType","GrossTonnage","res_8","co2_t","ch4_t"],
+               "keep":["dt_pos_utc","StandardVesselType","gt_code","res_8","co2_t","ch4_t"],
+               "dates":["dt_pos_utc"],
+               "category":["StandardVesselType"],
+               "float32":[]}}
+
+##Rows per chunk of the emissions CSV, see read_emissions
+EM_CHUNK_ROWS=200000
+##Vessel type of the emissions rows without one, only the map of all types takes them in
+NO_TYPE="Unknown"
+SOURCES=[schema["path"] for schema in SCHEMAS.values()]
+DATASETS=["canal","ports","gatun","em"]
+##Modules whose code shapes the cleaned frames, see code_version
+CLEANING_MODULES=["data_filtering","bitmap_index","controls","hexagons","snapshot"]
+
+log=logging.getLogger(__name__)
+
+##A rule value copied from another column of the same row
+Column=namedtuple("Column","name")
+
+##Vessel type and port normalization of the ports data, applied in order.
+##(rule, {column: values matched, None for missing}, column written, new value)
+TYPE_RULES=[("AIS type None as missing",{"vessel_type_main":["None"]},"vessel_type_main",None),
+            ("Container ships",{"vessel_type_main":["Container Ship"]},"Fleet Type","Containerships"),
+            ("PCC as Ro-Ro",{"Fleet Type":["PCC"]},"Fleet Type","Ro-Ro"),
+            ##Containers not in PATSA but in PSA
+            ("PATSA containers to PSA",{"Fleet Type":["Containerships"],"port_name":["Pacific - PATSA"]},
+             "port_name","Pacific - PSA"),
+            ##Nan replacements when possible
+            ("Missing type from AIS",{"Fleet Type":[None]},"Fleet Type",Column("vessel_type_main")),
+            ("Offshore",{"Fleet Type":["Offshore","Offshore Support Vessel"]},"Fleet Type","Offshore Vessel"),
+            ("General cargo",{"Fleet Type":["MPP","General Cargo Ship"]},"Fleet Type","General Cargo"),
+            ("Other tankers",{"Fleet Type":["Oil And Chemical Tanker","Chemical Tankers"]},"Fleet Type","Other Tanker"),
+            ("Cruise",{"Fleet Type":["Cruise"]},"Fleet Type","Passenger Ship"),
+            ("Bulkers",{"Fleet Type":["Bulkers"]},"Fleet Type","Bulk Carrier"),
+            ("Others",{"Fleet Type":["Fishing Vessel","Pleasure Craft","Service Ship","Cable Layer"]},
+             "Fleet Type","Others")]
+
+def read_dataset(name):
+    """
+    Raw frame of a dataset with only the columns of its schema.
+    """
+    schema=SCHEMAS[name]
+    
+    return pd.read_csv(schema["path"],usecols=schema["columns"])
+
+def read_emissions(gt_edges=GT_EDGES,chunksize=EM_CHUNK_ROWS,path=None):
+    """
+    Emissions summed per month, vessel type, GT bucket code (see bitmap_index.gt_codes) and
+    resolution 8 hexagon as uint64. The CSV is read chunksize rows at a time and each chunk is
+    summed on its own, so the raw rows are never held in full. The chunk sums are merged once
+    they outgrow the merged sums, which keeps the merges few.
+    Rows without a vessel type are kept as NO_TYPE. Sums stay float64, they are few next to
+    the rows and add up across chunks.
+    """
+    schema=SCHEMAS["em"]
+    keys=["dt_pos_utc","StandardVesselType","gt_code","res_8"]
+    merged,parts,pending=None,[],0
+    for chunk in pd.read_csv(path or schema["path"],usecols=schema["columns"],chunksize=chunksize):
+        ##Monthly dates, to_datetime parses each distinct string once
+        chunk["dt_pos_utc"]=pd.to_datetime(chunk["dt_pos_utc"])
+        chunk["StandardVesselType"]=chunk["StandardVesselType"].fillna(NO_TYPE)
+        chunk["gt_code"]=gt_codes(chunk.GrossTonnage.to_numpy(),gt_edges)
+        ##H3 cells as uint64, strings only for the cells sent to the map
+        chunk["res_8"]=h3_to_int(chunk["res_8"])
+        parts.append(chunk.groupby(keys,dropna=False)[["co2_t","ch4_t"]].sum())
+        pending+=len(parts[-1])
+        if pending>2*max(chunksize,0 if merged is None else len(merged)):
+            merged=merge_sums(parts if merged is None else [merged]+parts,keys)
+            parts,pending=[],0
+    
+    if merged is None and not parts:
+        return pd.DataFrame(columns=keys+["co2_t","ch4_t"])
+    
+    return merge_sums(parts if merged is None else [merged]+parts,keys).reset_index()
+
+def merge_sums(parts,keys):
+    """
+    One sum per key of partial sums indexed on keys.
+    """
+    return pd.concat(parts).groupby(level=keys,dropna=False).sum()
+
+def compact(df,name):
+    """
+    Cleaned frame cut to the kept columns of its schema, labels as categoricals
+    and measurements as float32.
+    """
+    schema=SCHEMAS[name]
+    df=df[schema.get("keep",schema["columns"])].copy()
+    for column in schema["category"]:
+        df[column]=df[column].astype("category")
+    for column in schema["float32"]:
+        df[column]=df[column].astype("float32")
+    
+    return df
+
+def report_memory(frames):
+    """
+    Log rows and resident bytes of every frame, strings and categories included.
+    """
+    for name,df in frames.items():
+        log.info("%s: %d rows, %.1f MB",name,len(df),df.memory_usage(index=True,deep=True).sum()/2**20)
+
+def apply_rules(df,rules):
+    """
+    Apply a rule table such as TYPE_RULES in order.
+    Rules run on the distinct combinations of the columns they read, which are few, and
+    the results reach the rows in a single pass over their codes.
+    Returns the frame and the number of rows each rule changed.
+    """
+    columns=[]
+    for name,conditions,target,value in rules:
+        for column in list(conditions)+[target]+([value.name] if isinstance(value,Column) else []):
+            if column not in columns:
+                columns.append(column)
+    
+    ##One code per row for its combination, missing values kept as their own code
+    codes,uniques=zip(*[pd.factorize(df[column]) for column in columns])
+    shape=tuple(len(u)+1 for u in uniques)
+    keys,inverse=np.unique(np.ravel_multi_index(tuple(c+1 for c in codes),shape),return_inverse=True)
+    inverse=inverse.reshape(-1)
+    rows=np.bincount(inverse,minlength=len(keys))
+    combos={column:np.append(np.asarray(u,dtype=object),None)[k-1]
+            for column,u,k in zip(columns,uniques,np.unravel_index(keys,shape))}
+    
+    touched={}
+    for name,conditions,target,value in rules:
+        match=np.ones(len(keys),dtype=bool)
+        for column,values in conditions.items():
+            match&=np.array([v in values for v in combos[column]],dtype=bool)
+        new=combos[target].copy()
+        new[match]=combos[value.name][match] if isinstance(value,Column) else value
+        touched[name]=int(rows[[a!=b for a,b in zip(combos[target],new)]].sum())
+        combos[target]=new
+    
+    for target in {rule[2] for rule in rules}:
+        final=np.array([np.nan if v is None else v for v in combos[target]],dtype=object)
+        df[target]=final[inverse]
+    
+    return df,touched
+
+def quantile_mask(df,by,columns,lower=0.05,upper=0.95,inclusive=True):
+    """
+    Per-group quantile trim over whole columns.
+    Returns a boolean mask of the rows where every one of columns lies between the
+    lower and upper quantiles of its group. Quantiles are computed for all groups
+    in one pass and broadcast back to the rows, NaN values and NaN keys give False, as does
+    every row of a frame without any key.
+    
+    Ex quantile_mask(df,"port_name",["waiting_time"],0.05,0.95,inclusive=False)
+    """
+    bounds=df.groupby(by,observed=True)[columns].quantile([lower,upper])
+    if bounds.empty:
+        ##No row with a key, as in an empty selection
+        return pd.Series(False,index=df.index)
+    lo=bounds.xs(lower,level=-1).reindex(df[by]).to_numpy()
+    hi=bounds.xs(upper,level=-1).reindex(df[by]).to_numpy()
+    values=df[columns].to_numpy()
+    
+    with np.errstate(invalid="ignore"):
+        if inclusive:
+            inside=(values>=lo)&(values<=hi)
+        else:
+            inside=(values>lo)&(values<hi)
+    
+    return pd.Series(inside.all(axis=1),index=df.index)
+
+def time_bounds(df,column,date_from,date_to):
+    """
+    Positions (lo, hi) of the rows of df whose column lies between date_from and date_to,
+    both inclusive. df must be sorted on column (NaT last), the window is found by
+    binary search instead of a mask over the whole frame.
+    """
+    values=df[column].to_numpy()
+    lo=values.searchsorted(pd.Timestamp(date_from).to_datetime64(),side="left")
+    hi=values.searchsorted(pd.Timestamp(date_to).to_datetime64(),side="right")
+    
+    return lo,hi
+
+def time_slice(df,column,date_from,date_to):
+    """
+    Rows of df within the date window as a positional slice, see time_bounds.
+    
+    Ex time_slice(gatun,"Date",pd.to_datetime("2019-01-01"),pd.to_datetime("2019-12-31"))
+    """
+    lo,hi=time_bounds(df,column,date_from,date_to)
+    
+    return df.iloc[lo:hi]
+
+def processed_data(FLEET):
+    ##Ports info adjust and filtering.
+    df=read_dataset("ports")
+    
+    ##Less than 30 mins as this is the minimum number of positions to have a. Then kalman didnt work. Fix kalman to avoid this.
+    ##Some didnt go thorugh kalman and have a faulty reading.
+    df["waiting_time"]=np.where(df.waiting_time<0.5,np.nan,df.waiting_time)
+    df["waiting_time"]=np.where(df.waiting_time>150,150,df.waiting_time)
+    
+    
+    ##Remove potential bunkering ops, Non in Telfer. 
+    ###There is no oil operations inside Canal other than bunkering supplied.
+    ###Need to refine to identify bunkering in Patsa from loading ops
+    df=df[~(df["Fleet Type"]=="Product Tankers")&(df["port_name"]!="Telfer")]
+    
+    ##Types adjustments, see TYPE_RULES
+    df,touched=apply_rules(df,TYPE_RULES)
+    for rule,count in touched.items():
+        log.info("%s: %d rows",rule,count)
+    
+    df=df[df["Fleet Type"].notnull()]
+    
+    ###As I dont recognize the servicing vessel, I will just keep containers, ro-ro and passagner. FOR THE MOMENT
+    
+    df=df[df["Fleet Type"].isin(["Containerships","Ro-Ro","Passenger Ship"])]
+    
+    ##Quantiles on service and waiting times to remove outliers. 10% winzorization
+    ##Direct visit from after lockage.
+    ##Rows keep the port by port order of the former groupby().apply
+    keep=df.waiting_time.isnull()|quantile_mask(df,"port_name",["service_time","waiting_time"],0.05,0.95)
+    df=df[keep&df.port_name.notnull()].sort_values("port_name",kind="mergesort").reset_index(drop=True)
+    
+    ###Panama Info. Next time, rescue types from AIS reading
+    
+    canal=read_dataset("canal")
+    canal=canal[canal["StandardVesselType"].isin(FLEET)]
+    
+    
+    ##Errors in values
+    return canal,df
+
+
+def event_table(canal,ports):
+    """
+    Port calls and direct canal transits in one table sorted by time, built once at load.
+    time is the service start or canal entrance, day its date, source "ports" or "canal".
+    """
+    columns=["time","day","waiting_time","service_time","port_name","draught_ratio","StandardVesselType","GT","source"]
+    
+    canal_in=canal[canal.direct_transit_boolean==True]
+    canal_in=canal_in.assign(time=canal_in.time_at_entrance,day=canal_in.time_at_entrance.dt.normalize(),source="canal")
+    ports_in=ports.assign(time=ports.initial_service,day=ports.initial_service.dt.normalize(),source="ports")
+    
+    events=pd.concat([ports_in[columns],canal_in[columns]],axis=0,ignore_index=True)
+    ##Categories differ between the two sources, the concat falls back to object
+    events=events.astype({"port_name":"category","StandardVesselType":"category","source":"category"})
+    
+    return events.sort_values("time",kind="mergesort").reset_index(drop=True)
+
+def build_datasets(FLEET):
+    """
+    Cleaned canal, ports and gatun frames with the date columns parsed, and the emissions
+    summed per resolution 8 cell by read_emissions, by name. Each sorted on its time column.
+    """
+    canal,ports=processed_data(FLEET)
+    gatun=read_dataset("gatun")
+    em=read_emissions()
+    
+    ##Transform to datetime. Preferred to read csv method which is less flexible.
+    for name,df in zip(["canal","ports","gatun"],[canal,ports,gatun]):
+        for column in SCHEMAS[name]["dates"]:
+            df[column]=pd.to_datetime(df[column])
+    
+    ##Categoricals and float32 once the cleaning is done
+    frames={name:compact(df,name) for name,df in zip(DATASETS,[canal,ports,gatun,em])}
+    
+    ##Sorted on time so date windows are binary searched, see time_slice
+    return {name:df.sort_values(SCHEMAS[name]["dates"][0],kind="mergesort").reset_index(drop=True)
+            for name,df in frames.items()}
+
+def code_version(FLEET,modules=CLEANING_MODULES):
+    """
+    Hash of the source of the given modules and of the cleaning parameters, a stored result
+    is stale once it changes.
+    """
+    sources=[]
+    for name in modules:
+        with open(importlib.import_module(name).__file__,"rb") as f:
+            sources.append(f.read())
+    
+    return snapshot_key([],extra=sources+[FLEET,GT_EDGES])
+
+def load_datasets(FLEET):
+    """
+    Frames of build_datasets as a list in DATASETS order.
+    Read from the columnar snapshot when neither the source CSVs nor this module
+    changed since it was written, otherwise rebuilt and snapshotted.
+    """
+    key=snapshot_key(SOURCES,extra=[code_version(FLEET)])
+    
+    frames=load_snapshot(key,DATASETS)
+    if frames is None:
+        frames=build_datasets(FLEET)
+        save_snapshot(key,frames)
+    
+    report_memory(frames)
+    
+    return [frames[name] for name in DATASETS]
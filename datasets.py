@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Datasets of the dashboard, and all that is derived from them at load time,
+behind a lazy accessor.
+
+Importing the app loads nothing. The first caller of get() builds the
+Datasets and later callers share them. warm() builds them in a background
+thread, so the server answers, health checks included, while the data loads.
+
+reload() builds fresh Datasets next to the loaded ones and swaps them in with
+one assignment. A callback that took the previous ones with get() keeps a
+consistent view until it returns. Listeners registered with on_load run once
+any Datasets are in, the first ones included, those registered with on_swap,
+such as cache clears, after every swap. watch() reloads when the inputs change.
+"""
+
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import time
+
+from controls import FLEET, GT_EDGES
+
+log = logging.getLogger(__name__)
+
+
+class Datasets:
+    """
+    Cleaned frames with their event table, indexes, rollups and emissions cube.
+
+    Ex data=datasets.get(); data.kpi.summary(date_from,date_to)
+    """
+
+    def __init__(self, fleet=FLEET):
+        started = time.monotonic()
+        ##Part of every cache key derived from these datasets. version counts loads in this
+        ##process, signature names the inputs for caches shared between processes.
+        self.version = next(_versions)
+        self.signature = hashlib.sha1(repr(input_signature()).encode()).hexdigest()[:16]
+
+        ##Heavy imports stay out of the app import
+        import geopandas as gpd
+        from bitmap_index import BitmapIndex
+        from choropleth_map_emission import emissions_cube, emissions_geojson
+        from data_filtering import load_datasets, event_table
+        from rollups import KpiRollup, DraughtRollup
+        from store import LAZY, load_store, read_manifest
+
+        ##Month partitioned store when built, see store.py, else the raw inputs. The store
+        ##leaves gatun to be read per date window, see gatun_rows.
+        manifest = read_manifest()
+        frames = load_store(fleet=fleet, lazy=LAZY, manifest=manifest)
+        self.manifest = manifest if frames else None
+        self.canal, self.ports, self.gatun, self.em = frames or load_datasets(fleet)
+        ##Date slider of these frames, see slider_range
+        self.slider = slider_range(self.canal, self.ports, self.gatun, self.manifest)
+        self.events = event_table(self.canal, self.ports)
+        self.events_index = BitmapIndex(self.events, ["port_name", "StandardVesselType"],
+                                        gt="GT", gt_edges=GT_EDGES)
+        self.kpi = KpiRollup(self.events, self.events_index, GT_EDGES)
+        self.draught = DraughtRollup(self.events, self.events_index, GT_EDGES)
+        self.em_cube = emissions_cube(self.em)
+        ##Hexagon boundaries computed once here, maps only look them up
+        self.em_geojson = emissions_geojson(self.em_cube)
+
+        ##Ports color
+        self.panama_ports = gpd.read_file("data/Panama_ports.geojson").assign(color="#F9A054")
+        pol = gpd.read_file("data/Panama_Canal.geojson")[["Name", "geometry"]]
+        self.pol = pol[pol.geometry.apply(lambda x: x.geom_type == "Polygon")]
+
+        log.info("Datasets version %d loaded in %.1f s", self.version, time.monotonic() - started)
+
+    def gatun_rows(self, date_from, date_to):
+        """
+        Gatun rows covering the inclusive dates, only the months of the window when read
+        from the store.
+        """
+        if self.gatun is not None:
+            return self.gatun
+        from store import load_range
+
+        return load_range("gatun", date_from, date_to, manifest=self.manifest)
+
+
+_current = None
+_lock = threading.Lock()
+_reload_lock = threading.Lock()
+_versions = itertools.count(1)
+_listeners = []
+_load_listeners = []
+
+##Seconds between checks of the inputs by watch, 0 turns watching off
+WATCH_SECONDS = float(os.environ.get("DATA_WATCH_SECONDS", 0))
+
+
+def _after_fork():
+    ##Background callback jobs are forked from threaded workers, a lock held by another
+    ##thread at that moment would never be released in the child
+    global _lock, _reload_lock
+    _lock = threading.Lock()
+    _reload_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def get():
+    """
+    The loaded Datasets, built on first use. Concurrent first callers wait for one build.
+    """
+    global _current
+    if _current is None:
+        with _lock:
+            if _current is None:
+                _current = Datasets()
+                for listener in _load_listeners:
+                    listener(_current)
+    return _current
+
+
+def ready():
+    return _current is not None
+
+
+def warm():
+    """
+    Build the datasets in a background thread unless they are loaded already.
+    """
+    if ready():
+        return None
+    thread = threading.Thread(target=get, name="datasets-warm", daemon=True)
+    thread.start()
+    return thread
+
+
+def on_load(listener):
+    """
+    Register listener(datasets) to run once Datasets are built, by the first get() and by
+    every reload, before the swap listeners. Usable as a decorator.
+    """
+    _load_listeners.append(listener)
+    return listener
+
+
+def on_swap(listener):
+    """
+    Register listener(datasets) to run after every reload swap. Usable as a decorator.
+    """
+    _listeners.append(listener)
+    return listener
+
+
+def reload():
+    """
+    Build fresh Datasets from the current inputs and swap them in. One reload runs at a
+    time, the loaded datasets serve meanwhile and stay in place if the build fails.
+    """
+    global _current
+    with _reload_lock:
+        fresh = Datasets()
+        _current = fresh
+    for listener in _load_listeners + _listeners:
+        listener(fresh)
+    return fresh
+
+
+def reload_async():
+    thread = threading.Thread(target=_reload_logged, name="datasets-reload", daemon=True)
+    thread.start()
+    return thread
+
+
+def _reload_logged():
+    try:
+        reload()
+    except Exception:
+        log.exception("Reload failed, keeping datasets version %s", _current and _current.version)
+
+
+def slider_range(canal, ports, gatun, manifest=None):
+    """
+    First month, number of months and last Gatun date of the date slider, as
+    store.slider_range gives them. From the manifest of the store the frames were read
+    from, else from the frames. None without any date.
+    """
+    from store import slider_range as stored_range, slider_span
+
+    if manifest is not None:
+        return stored_range(manifest)
+    starts = [df[column].min() for df, column in [(ports, "initial_service"), (canal, "time_at_entrance")]
+              if df[column].notnull().any()]
+    if not starts:
+        return None
+    ends = [df[column].max() for df, column in [(ports, "initial_service"), (canal, "time_at_entrance")]
+            if df[column].notnull().any()]
+    gatun_end = gatun.Date.max().normalize().to_pydatetime() if gatun.Date.notnull().any() else None
+    return slider_span(min(starts), max(ends), gatun_end)
+
+
+def input_signature():
+    """
+    Modification time and size of the raw inputs and of the store manifest.
+    """
+    from data_filtering import SOURCES
+    from store import STORE_PATH, MANIFEST
+
+    signature = []
+    for path in SOURCES + [os.path.join(STORE_PATH, MANIFEST)]:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
+def watch(interval=WATCH_SECONDS):
+    """
+    Reload in a daemon thread whenever the inputs change, checked every interval seconds.
+    A change is picked up once it held for a whole interval, so files still being
+    written are not read. Does nothing when interval is 0.
+    """
+    if not interval:
+        return None
+
+    def run():
+        loaded = seen = input_signature()
+        while True:
+            time.sleep(interval)
+            current = input_signature()
+            if current == seen and current != loaded:
+                loaded = current
+                _reload_logged()
+            seen = current
+
+    thread = threading.Thread(target=run, name="datasets-watch", daemon=True)
+    thread.start()
+    return thread
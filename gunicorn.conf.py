@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Gunicorn settings, see the Procfile.
+
+The master imports app.py once and the workers are forked from it. Importing
+the app loads no data (see datasets.py). With SHARED_DATASETS on, the default,
+the master loads the datasets before forking, so the frames, indexes, rollups
+and hexagon boundaries sit in pages shared copy-on-write by every worker, and
+a restarted worker is ready as soon as it is forked. With SHARED_DATASETS=0
+every worker loads its own copy in the background and answers /healthz
+meanwhile. Workers count from WEB_CONCURRENCY as usual. Data reloaded later,
+see datasets.reload, is private to each worker.
+"""
+
+import gc
+import os
+
+preload_app = True
+
+##Threads per worker, more than one runs the gthread worker. Callbacks share no
+##mutable state, so a few threads per worker can serve one copy of the data.
+threads = int(os.environ.get("WEB_THREADS", 1))
+
+SHARED_DATASETS = os.environ.get("SHARED_DATASETS", "1") != "0"
+
+
+def when_ready(server):
+    if SHARED_DATASETS:
+        import datasets
+        datasets.get()
+
+    ##Everything loaded so far goes to the permanent generation. The collector would
+    ##otherwise write its bookkeeping into those objects and copy their pages per worker.
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import app
+    import datasets
+    datasets.warm()
+    ##Every worker reloads on its own when DATA_WATCH_SECONDS is set
+    datasets.watch()
+    ##Figures of the default and WARM_STATES selections, once the datasets are in. Workers
+    ##forked later read what the first ones built from the shared figure tier.
+    app.warm_figures()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+H3 cells held as uint64 arrays, and their GeoJSON geometry.
+
+An H3 index keeps its resolution in bits 52-55 and one 3 bit digit per
+resolution below that, unused digits set to 7. Going to a coarser resolution
+is then a mask over the whole array instead of one h3 call per row.
+
+A hexagon boundary never changes, so each one is computed once per process
+and reused by every map.
+"""
+
+from functools import lru_cache
+
+import h3
+import numpy as np
+
+H3_RES_OFFSET = np.uint64(52)
+H3_RES_MASK = np.uint64(15) << H3_RES_OFFSET
+H3_MAX_RES = 15
+
+
+def h3_to_int(hexes):
+    """
+    uint64 array from H3 hex strings. Each distinct cell is parsed once.
+    """
+    hexes = np.asarray(hexes, dtype=object)
+    cells, inverse = np.unique(hexes, return_inverse=True)
+    ints = np.array([int(x, 16) for x in cells], dtype=np.uint64)
+    return ints[inverse]
+
+
+def int_to_h3(cells):
+    """
+    H3 hex strings from uint64 cells, for the few cells handed to plotly.
+    """
+    return [format(int(x), "x") for x in cells]
+
+
+def h3_parent(cells, resolution):
+    """
+    Parent of every cell at a coarser resolution, computed on the whole array.
+
+    Ex h3_parent(em.res_8.to_numpy(), 6)
+    """
+    cells = np.asarray(cells, dtype=np.uint64)
+    unused = np.uint64((1 << (3 * (H3_MAX_RES - resolution))) - 1)
+    return (cells & ~H3_RES_MASK) | (np.uint64(resolution) << H3_RES_OFFSET) | unused
+
+
+@lru_cache(maxsize=None)
+def hex_feature(hex_id):
+    """
+    GeoJSON feature of one hexagon, id set to the hex string for plotly locations.
+    """
+    return {"type": "Feature", "id": hex_id,
+            "geometry": {"type": "Polygon",
+                         "coordinates": [h3.h3_to_geo_boundary(hex_id, geo_json=True)]}}
+
+
+def hex_collection(hex_ids):
+    """
+    FeatureCollection of the given hexagons from the cached features.
+    """
+    return {"type": "FeatureCollection", "features": [hex_feature(h) for h in hex_ids]}
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-aggregated rollups of the event table, built once at load time.
+
+Events are grouped in cells of (port, vessel type, GT bucket). Day totals per
+cell are kept as cumulative sums, so the totals of any run of whole days are
+one subtraction. The part of a window that does not cover whole days is read
+from the event table itself. The draught ratio chart gets the same treatment
+with weekly sums.
+"""
+
+import numpy as np
+import pandas as pd
+
+from bitmap_index import gt_codes, gt_range_codes
+from data_filtering import time_bounds
+
+NS = pd.Timedelta(1, unit="ns")
+
+
+def whole_days(date_from, date_to):
+    """
+    First and end (exclusive) midnight of the whole days inside the inclusive window.
+    """
+    start = pd.Timestamp(date_from).ceil("D")
+    end = (pd.Timestamp(date_to) + NS).floor("D")
+    return start, max(start, end)
+
+
+class KpiRollup:
+    """
+    Cumulative day totals per cell for the summary row: operations, and the sum and
+    non-null count of waiting_time and service_time.
+
+    Ex kpi=KpiRollup(events,events_index,GT_EDGES)
+       waiting,ops,service=kpi.summary(date_from,date_to,None,("Container",),(400.0,170000.0))
+    """
+
+    STATS = ["ops", "waiting_sum", "waiting_n", "service_sum", "service_n"]
+
+    def __init__(self, events, events_index, gt_edges):
+        self.events = events
+        self.events_index = events_index
+        self.gt_edges = gt_edges
+
+        timed = events[events.time.notnull()]
+        self.days = np.unique(timed.day.to_numpy())
+        day = self.days.searchsorted(timed.day.to_numpy())
+
+        ##One integer key per (port, type, GT bucket), NaN kept as its own value
+        port, ports = pd.factorize(timed.port_name)
+        vessel, vessels = pd.factorize(timed.StandardVesselType)
+        gt = gt_codes(timed.GT.to_numpy(), gt_edges) + 2
+        shape = (len(ports) + 1, len(vessels) + 1, 2 * len(gt_edges) + 2)
+        combined = np.ravel_multi_index((port + 1, vessel + 1, gt), shape)
+        keys, cell = np.unique(combined, return_inverse=True)
+        cell = cell.reshape(-1)
+        cells = len(keys)
+
+        port, vessel, gt = np.unravel_index(keys, shape)
+        self.cell_port = np.append(np.asarray(ports, dtype=object), np.nan)[port - 1]
+        self.cell_type = np.append(np.asarray(vessels, dtype=object), np.nan)[vessel - 1]
+        self.cell_gt = gt - 2
+
+        waiting = timed.waiting_time.to_numpy(dtype=float)
+        service = timed.service_time.to_numpy(dtype=float)
+        weights = [None, np.nan_to_num(waiting), ~np.isnan(waiting),
+                   np.nan_to_num(service), ~np.isnan(service)]
+
+        flat = day * cells + cell
+        self.cumulative = np.zeros((len(self.STATS), len(self.days) + 1, cells))
+        for i, w in enumerate(weights):
+            totals = np.bincount(flat, weights=w, minlength=len(self.days) * cells).reshape(len(self.days), cells)
+            self.cumulative[i, 1:] = totals.cumsum(axis=0)
+
+    def _cells(self, ports_key, types_key, size_key):
+        keep = np.ones(len(self.cell_gt), dtype=bool)
+        if ports_key is not None:
+            keep &= np.isin(self.cell_port, list(ports_key))
+        if types_key is not None:
+            keep &= np.isin(self.cell_type, list(types_key))
+        if size_key is not None:
+            full, partial = gt_range_codes(size_key, self.gt_edges)
+            if partial:
+                return None
+            keep &= np.isin(self.cell_gt, full)
+        return keep
+
+    def _events_totals(self, date_from, date_to, ports_key, types_key, size_key):
+        lo, hi = time_bounds(self.events, "time", date_from, date_to)
+        if hi <= lo:
+            return np.zeros(len(self.STATS))
+        keep = self.events_index.select(lo, hi, port_name=ports_key,
+                                        StandardVesselType=types_key, gt=size_key)
+        rows = self.events.iloc[lo:hi][keep]
+        return np.array([len(rows), rows.waiting_time.sum(), rows.waiting_time.count(),
+                         rows.service_time.sum(), rows.service_time.count()], dtype=float)
+
+    def totals(self, date_from, date_to, ports_key=None, types_key=None, size_key=None):
+        """
+        Stats of STATS for the inclusive window and filters, keys as in app.filter_key.
+        """
+        cells = self._cells(ports_key, types_key, size_key)
+        start, end = whole_days(date_from, date_to)
+        if cells is None or start >= end:
+            ##GT range off the slider edges or no whole day, read the events directly
+            return self._events_totals(date_from, date_to, ports_key, types_key, size_key)
+
+        lo = self.days.searchsorted(start.to_datetime64())
+        hi = self.days.searchsorted(end.to_datetime64())
+        totals = (self.cumulative[:, hi, cells] - self.cumulative[:, lo, cells]).sum(axis=1)
+
+        ##Partial days at both ends of the window
+        if date_from < start:
+            totals += self._events_totals(date_from, start - NS, ports_key, types_key, size_key)
+        totals += self._events_totals(end, date_to, ports_key, types_key, size_key)
+        return totals
+
+    def summary(self, date_from, date_to, ports_key=None, types_key=None, size_key=None):
+        """
+        Waiting mean, operations and service mean, as shown in the summary row.
+        """
+        ops, waiting_sum, waiting_n, service_sum, service_n = self.totals(
+            date_from, date_to, ports_key, types_key, size_key)
+        waiting = waiting_sum / waiting_n if waiting_n else np.nan
+        service = service_sum / service_n if service_n else np.nan
+        return waiting, int(round(ops)), service
+
+
+def week_labels(days):
+    """
+    (calendar year, ISO week) of each day, the grouping of the draught ratio chart.
+    """
+    days = pd.DatetimeIndex(days)
+    return days.year.to_numpy(), days.isocalendar().week.to_numpy(dtype=int)
+
+
+def week_label_dates(years, weeks):
+    """
+    Date of each (year, week) label as pd.to_datetime("<year>-<week>-1", format="%Y-%W-%w")
+    gives it, the Monday of %W week number week of year, without parsing strings.
+    """
+    jan1 = pd.to_datetime(pd.DataFrame({"year": years, "month": 1, "day": 1}))
+    first_monday = (7 - jan1.dt.weekday) % 7
+    return jan1 + pd.to_timedelta(first_monday + 7 * (np.asarray(weeks) - 1), unit="D")
+
+
+def week_segments(days):
+    """
+    Start and end (exclusive) of the Monday to Sunday week of each day, cut at new year
+    so the (year, ISO week) label is constant inside a segment.
+    """
+    days = pd.DatetimeIndex(days)
+    monday = days - pd.to_timedelta(days.weekday, unit="D")
+    jan1 = days.to_period("Y").to_timestamp()
+    next_jan1 = (days.to_period("Y") + 1).to_timestamp()
+    start = np.maximum(monday.to_numpy(), jan1.to_numpy())
+    end = np.minimum((monday + pd.Timedelta(days=7)).to_numpy(), next_jan1.to_numpy())
+    return start, end
+
+
+class DraughtRollup:
+    """
+    Weekly draught ratio sum, non-null count and rows per (week segment, vessel type,
+    port, GT bucket). Whole segments of a window come from the rollup, the events of
+    the partial segments at its ends from the event table.
+
+    Ex weekly=DraughtRollup(events,events_index,GT_EDGES).weekly(date_from,date_to)
+    """
+
+    def __init__(self, events, events_index, gt_edges):
+        self.events = events
+        self.events_index = events_index
+        self.gt_edges = gt_edges
+
+        timed = events[events.time.notnull() & events.StandardVesselType.notnull()]
+        rows = self._label(timed)
+        rows["start"], rows["end"] = week_segments(timed.day)
+        rows["port_name"] = timed.port_name.to_numpy()
+        rows["gt"] = gt_codes(timed.GT.to_numpy(), gt_edges)
+
+        keys = ["start", "end", "year", "week", "StandardVesselType", "port_name", "gt"]
+        weekly = rows.groupby(keys, sort=True, dropna=False)[["ratio_sum", "ratio_n", "rows"]].sum()
+        self.weekly_rows = weekly.reset_index()
+        self.starts = self.weekly_rows.start.to_numpy()
+        self.ends = self.weekly_rows.end.to_numpy()
+
+    def _label(self, rows):
+        year, week = week_labels(rows.day)
+        ratio = rows.draught_ratio.to_numpy(dtype=float)
+        return pd.DataFrame({"year": year, "week": week,
+                             "StandardVesselType": rows.StandardVesselType.to_numpy(),
+                             "ratio_sum": np.nan_to_num(ratio), "ratio_n": ~np.isnan(ratio),
+                             "rows": 1})
+
+    def _events_rows(self, date_from, date_to, ports_key, types_key, size_key):
+        lo, hi = time_bounds(self.events, "time", date_from, date_to)
+        if hi <= lo:
+            return None
+        keep = self.events_index.select(lo, hi, port_name=ports_key,
+                                        StandardVesselType=types_key, gt=size_key)
+        rows = self.events.iloc[lo:hi][keep]
+        return self._label(rows[rows.StandardVesselType.notnull()])
+
+    def weekly(self, date_from, date_to, ports_key=None, types_key=None, size_key=None):
+        """
+        Mean draught ratio per (year, ISO week) label and vessel type within the inclusive
+        window and filters, as day, StandardVesselType and draught_ratio sorted by day.
+        """
+        parts = []
+        lo = self.starts.searchsorted(pd.Timestamp(date_from).to_datetime64(), side="left")
+        hi = self.ends.searchsorted((pd.Timestamp(date_to) + NS).to_datetime64(), side="right")
+        full, partial = gt_range_codes(size_key, self.gt_edges) if size_key is not None else (None, [])
+
+        if lo < hi and not partial:
+            ##Whole segments from the rollup, events before and after them read directly
+            weekly = self.weekly_rows.iloc[lo:hi]
+            keep = np.ones(len(weekly), dtype=bool)
+            if ports_key is not None:
+                keep &= weekly.port_name.isin(ports_key).to_numpy()
+            if types_key is not None:
+                keep &= weekly.StandardVesselType.isin(types_key).to_numpy()
+            if full is not None:
+                keep &= weekly["gt"].isin(full).to_numpy()
+            parts.append(weekly[keep])
+            edges = [(date_from, pd.Timestamp(self.starts[lo]) - NS), (pd.Timestamp(self.ends[hi - 1]), date_to)]
+        else:
+            edges = [(date_from, date_to)]
+
+        for fr, to in edges:
+            rows = self._events_rows(fr, to, ports_key, types_key, size_key)
+            if rows is not None:
+                parts.append(rows)
+
+        columns = ["year", "week", "StandardVesselType", "ratio_sum", "ratio_n", "rows"]
+        grouped = pd.concat([part[columns] for part in parts], ignore_index=True) if parts \
+            else pd.DataFrame(columns=columns)
+        grouped = grouped.groupby(["week", "year", "StandardVesselType"])[["ratio_sum", "ratio_n", "rows"]].sum()
+        grouped = grouped[grouped.rows > 0].reset_index()
+        if grouped.empty:
+            return pd.DataFrame(columns=["day", "StandardVesselType", "draught_ratio"])
+
+        ratio_n = grouped.ratio_n.to_numpy(dtype=float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratio = np.where(ratio_n > 0, grouped.ratio_sum.to_numpy(dtype=float) / ratio_n, np.nan)
+        series = pd.DataFrame({"day": week_label_dates(grouped.year.to_numpy(), grouped.week.to_numpy()),
+                               "StandardVesselType": grouped.StandardVesselType.to_numpy(),
+                               "draught_ratio": ratio})
+        return series.sort_values("day", kind="mergesort").reset_index(drop=True)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar snapshot of the cleaned datasets.
+
+Frames are written as Feather (Arrow IPC) files under data/snapshot/<key>,
+where the key hashes the source files and the cleaning code. A worker that
+finds a snapshot with its key skips CSV parsing and cleaning altogether.
+"""
+
+import hashlib
+import os
+import shutil
+
+import pandas as pd
+
+SNAPSHOT_PATH = "data/snapshot"
+
+
+def snapshot_key(paths, extra=()):
+    """
+    Content hash of the given files plus any extra values (code version, parameters).
+    A missing file hashes as empty so the key still changes once it shows up.
+    """
+    h = hashlib.sha1()
+    for path in paths:
+        h.update(path.encode())
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+    for value in extra:
+        h.update(repr(value).encode())
+    return h.hexdigest()[:16]
+
+
+def load_snapshot(key, names):
+    """
+    Dict of frames stored under key, or None when there is no complete snapshot
+    or pyarrow is not available.
+    """
+    folder = os.path.join(SNAPSHOT_PATH, key)
+    files = [os.path.join(folder, name + ".feather") for name in names]
+    if not all(os.path.exists(f) for f in files):
+        return None
+    try:
+        return {name: pd.read_feather(f) for name, f in zip(names, files)}
+    except (ImportError, OSError, ValueError):
+        return None
+
+
+def save_snapshot(key, frames):
+    """
+    Write frames under key and drop snapshots of older keys.
+    The folder is filled under a temporary name and renamed, so concurrent
+    workers never read a half written snapshot.
+    """
+    folder = os.path.join(SNAPSHOT_PATH, key)
+    tmp = "{}.tmp{}".format(folder, os.getpid())
+    try:
+        os.makedirs(tmp, exist_ok=True)
+        for name, df in frames.items():
+            df.reset_index(drop=True).to_feather(os.path.join(tmp, name + ".feather"))
+        os.rename(tmp, folder)
+    except (ImportError, OSError, ValueError):
+        ##No pyarrow, read-only disk or another worker got there first.
+        shutil.rmtree(tmp, ignore_errors=True)
+        return False
+
+    for old in os.listdir(SNAPSHOT_PATH):
+        if old != key and ".tmp" not in old:
+            shutil.rmtree(os.path.join(SNAPSHOT_PATH, old), ignore_errors=True)
+    return True
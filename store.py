@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Month partitioned store of the cleaned datasets, built offline with
+
+    python store.py build [--store data/store] [--force]
+
+Each dataset of data_filtering.build_datasets is cut by month of its time
+column into <store>/<dataset>/<YYYY-MM>.feather, rows without a date go to
+none.feather. manifest.json lists per dataset its date range, rows and
+partitions, each with its rows and a content hash, and the hash of its
+columns and types, plus the version of the cleaning code and of this module
+and the size, modification time and hash of every raw input it was built from.
+A rebuild only writes the partitions whose content changed, so a new month
+of data is one new file.
+
+The app reads only the manifest at startup, for the date slider. The
+partitions are read when the datasets are first needed, see datasets.py.
+Those in LAZY are read by month when a date window asks for them, see
+load_range, the others feed indexes of the whole history and are read in
+full. pandas and the cleaning code are imported there too, the app imports
+this module at startup.
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from controls import FLEET
+
+STORE_PATH = "data/store"
+MANIFEST = "manifest.json"
+NO_DATE = "none"
+##Datasets read by month on demand, see load_range
+LAZY = ("gatun",)
+##Partitions held by read_partition
+PARTITION_CACHE = 64
+
+log = logging.getLogger(__name__)
+
+
+def read_manifest(store=STORE_PATH):
+    """
+    Manifest of the store, None when there is no store or it cannot be read.
+    """
+    try:
+        with open(os.path.join(store, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def store_version(fleet=FLEET):
+    """
+    Version of the cleaning code and of the store layout, a store of another version is stale.
+    """
+    from data_filtering import CLEANING_MODULES, code_version
+
+    return code_version(fleet, CLEANING_MODULES + ["store"])
+
+
+def source_files():
+    """
+    Size, modification time and content hash of every raw input that exists, by path.
+    """
+    from data_filtering import SOURCES
+    from snapshot import snapshot_key
+
+    files = {}
+    for path in SOURCES:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            files[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": snapshot_key([path])}
+    return files
+
+
+def changed_sources(manifest):
+    """
+    Raw inputs whose content differs from the one the store was built from. Inputs not
+    deployed next to the store are not compared, and unchanged size and time are trusted.
+    """
+    from snapshot import snapshot_key
+
+    changed = []
+    for path, built in manifest.get("sources", {}).items():
+        if not os.path.exists(path):
+            continue
+        stat = os.stat(path)
+        if (stat.st_size, stat.st_mtime_ns) == (built["size"], built["mtime_ns"]):
+            continue
+        if snapshot_key([path]) != built["hash"]:
+            changed.append(path)
+    return changed
+
+
+def schema_hash(df):
+    """
+    Hash of the column names and types of a frame.
+    """
+    return hashlib.sha1(repr(list(df.dtypes.astype(str).items())).encode()).hexdigest()[:16]
+
+
+def partition_hash(df):
+    """
+    Content hash of a partition, columns and types included.
+    """
+    import pandas as pd
+
+    h = hashlib.sha1(repr(list(df.dtypes.astype(str).items())).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()[:16]
+
+
+def partitions(df, column):
+    """
+    (month, rows) of df by month of column, as "YYYY-MM", then the rows without a date.
+    """
+    months = df[column].dt.strftime("%Y-%m")
+    for month in sorted(months.dropna().unique()):
+        yield month, df[months == month]
+    if months.isnull().any():
+        yield NO_DATE, df[months.isnull()]
+
+
+def write_partition(path, df):
+    tmp = "{}.tmp{}".format(path, os.getpid())
+    df.reset_index(drop=True).to_feather(tmp)
+    os.replace(tmp, path)
+
+
+def build(store=STORE_PATH, fleet=FLEET, force=False):
+    """
+    Clean the raw inputs and write the changed partitions and the manifest.
+    Returns the manifest.
+    """
+    import pandas as pd
+    from data_filtering import SCHEMAS, build_datasets, report_memory
+
+    started = time.monotonic()
+    old = read_manifest(store) or {}
+    version = store_version(fleet)
+    if old.get("version") != version:
+        force = True
+
+    frames = build_datasets(fleet)
+    report_memory(frames)
+    manifest = {"version": version, "built": pd.Timestamp.utcnow().isoformat(),
+                "sources": source_files(), "datasets": {}}
+    written = 0
+    for name, df in frames.items():
+        column = SCHEMAS[name]["dates"][0]
+        folder = os.path.join(store, name)
+        os.makedirs(folder, exist_ok=True)
+        before = old.get("datasets", {}).get(name, {}).get("partitions", {})
+
+        parts = {}
+        for month, part in partitions(df, column):
+            digest = partition_hash(part)
+            path = os.path.join(folder, month + ".feather")
+            if force or before.get(month, {}).get("hash") != digest or not os.path.exists(path):
+                write_partition(path, part)
+                written += 1
+            parts[month] = {"rows": len(part), "hash": digest}
+
+        ##Months gone from the data
+        for month in set(before) - set(parts):
+            path = os.path.join(folder, month + ".feather")
+            if os.path.exists(path):
+                os.remove(path)
+
+        dates = df[column].dropna()
+        manifest["datasets"][name] = {
+            "time_column": column, "rows": len(df), "partitions": parts, "schema": schema_hash(df),
+            "start": dates.min().isoformat() if len(dates) else None,
+            "end": dates.max().isoformat() if len(dates) else None}
+
+    tmp = os.path.join(store, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, os.path.join(store, MANIFEST))
+    log.info("Store built in %.1f s, %d partitions written", time.monotonic() - started, written)
+    return manifest
+
+
+def load_store(store=STORE_PATH, fleet=FLEET, lazy=(), manifest=None):
+    """
+    Frames of the store by name in DATASETS order, as load_datasets returns them, or None
+    when there is no store, it was built by another version of the code or from other raw
+    inputs than those in data/, or a frame does not have the columns and types it was stored with. Datasets in lazy come back as None, for
+    load_range, their schema is checked on their first partition. manifest is read from the
+    store when not given.
+    """
+    from data_filtering import DATASETS, report_memory
+
+    manifest = manifest or read_manifest(store)
+    if manifest is None:
+        return None
+    if manifest.get("version") != store_version(fleet):
+        log.warning("Store at %s is out of date, rebuild it with python store.py build", store)
+        return None
+    changed = changed_sources(manifest)
+    if changed:
+        log.warning("Store at %s was built before %s changed, rebuild it with python store.py build",
+                    store, ", ".join(changed))
+        return None
+
+    frames = {}
+    for name in DATASETS:
+        entry = manifest["datasets"][name]
+        months = stored_months(entry)
+        if name in lazy:
+            frames[name] = None
+            months = months[:1]
+        df = read_months(store, name, entry, months)
+        if months and df.shape[1] and schema_hash(df) != entry.get("schema"):
+            log.warning("Store at %s holds %s with other columns, rebuild it with python store.py build",
+                        store, name)
+            return None
+        if name not in lazy:
+            frames[name] = df
+
+    report_memory({name: df for name, df in frames.items() if df is not None})
+    return [frames[name] for name in DATASETS]
+
+
+def stored_months(entry):
+    ##Partitions in month order keep each frame sorted on time, undated rows last
+    months = sorted(m for m in entry["partitions"] if m != NO_DATE)
+    return months + ([NO_DATE] if NO_DATE in entry["partitions"] else [])
+
+
+@functools.lru_cache(maxsize=PARTITION_CACHE)
+def read_partition(path, digest):
+    ##Keyed on the content hash too, a rewritten partition is read again. Callers copy.
+    import pandas as pd
+
+    return pd.read_feather(path)
+
+
+def read_months(store, name, entry, months):
+    """
+    The given partitions of a dataset as one frame, with its categories.
+    """
+    import pandas as pd
+    from data_filtering import SCHEMAS
+
+    parts = [read_partition(os.path.join(store, name, m + ".feather"), entry["partitions"][m]["hash"])
+             for m in months]
+    df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    ##Categories differ between partitions, the concat falls back to object
+    for column in SCHEMAS[name]["category"]:
+        if column in df:
+            df[column] = df[column].astype("category")
+    return df
+
+
+def load_range(name, date_from, date_to, store=STORE_PATH, manifest=None):
+    """
+    Rows of a dataset of the store in the months of the inclusive window, sorted on time.
+    Only those partitions are read, and kept for the next windows. Undated rows are left out.
+
+    Ex load_range("gatun",pd.to_datetime("2019-01-01"),pd.to_datetime("2019-12-31"))
+    """
+    manifest = manifest or read_manifest(store)
+    entry = manifest["datasets"][name]
+    dated = [m for m in stored_months(entry) if m != NO_DATE]
+    months = [m for m in dated if date_from.strftime("%Y-%m") <= m <= date_to.strftime("%Y-%m")]
+    if months:
+        return read_months(store, name, entry, months)
+    ##No month in the window, no rows but the columns
+    return read_months(store, name, entry, dated[:1]).iloc[:0]
+
+
+def manifest_date(value):
+    ##Day of an isoformat timestamp of the manifest
+    return datetime.strptime(value[:10], "%Y-%m-%d")
+
+
+def slider_span(start, end, gatun_end):
+    """
+    First month of start, number of months after it up to end, and gatun_end, as the date
+    slider takes them.
+    """
+    start = datetime(start.year, start.month, 1)
+    return start, (end.year - start.year) * 12 + end.month - start.month, gatun_end
+
+
+def slider_range(manifest, names=("ports", "canal")):
+    """
+    slider_span of the dates covered by the given datasets, and the last Gatun date or None.
+    None without a manifest.
+    """
+    if manifest is None:
+        return None
+    entries = [manifest["datasets"][name] for name in names if manifest["datasets"][name]["start"]]
+    if not entries:
+        return None
+    gatun_end = manifest["datasets"]["gatun"]["end"]
+    return slider_span(min(manifest_date(e["start"]) for e in entries), max(manifest_date(e["end"]) for e in entries),
+                       manifest_date(gatun_end) if gatun_end else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the month partitioned data store.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--store", default=STORE_PATH)
+    parser.add_argument("--force", action="store_true", help="rewrite every partition")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    manifest = build(args.store, force=args.force)
+    for name, entry in manifest["datasets"].items():
+        print("{}: {} rows in {} partitions, {} to {}".format(
+            name, entry["rows"], len(entry["partitions"]), entry["start"], entry["end"]))
+
+
+if __name__ == "__main__":
+    main()
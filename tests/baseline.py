@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+The cleaning and chart code as it stood before the rewrites, kept verbatim but for the
+module level frames it read, to check the current code against.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def fleet_types(df):
+    ##Containers not in PATSA in PSA and Types adjustments
+    df["Fleet Type"]=np.where(df.vessel_type_main=="Container Ship","Containerships",df["Fleet Type"])
+    df["Fleet Type"]=np.where(df["Fleet Type"]=="PCC","Ro-Ro",df["Fleet Type"])
+    df["port_name"]=np.where(df["Fleet Type"]=="Containerships",np.where(df["port_name"]=="Pacific - PATSA",
+                              "Pacific - PSA",df["port_name"]),df["port_name"])
+
+    ##Nan replacements when possible
+    df["Fleet Type"]=np.where(df["Fleet Type"].isnull(),
+                              np.where(df.vessel_type_main!="None",df.vessel_type_main,df["Fleet Type"]),
+                                        df["Fleet Type"])
+
+    ##Types fix
+
+    df["Fleet Type"]=np.where(df["Fleet Type"].isin(["Offshore","Offshore Support Vessel"]),"Offshore Vessel",df["Fleet Type"])
+
+    df["Fleet Type"]=np.where(df["Fleet Type"].isin(["MPP","General Cargo Ship"]),"General Cargo",df["Fleet Type"])
+
+    df["Fleet Type"]=np.where(df["Fleet Type"].isin(["Oil And Chemical Tanker","Chemical Tankers"]),"Other Tanker",df["Fleet Type"])
+
+    df["Fleet Type"]=np.where(df["Fleet Type"].isin(["Cruise"]),"Passenger Ship",df["Fleet Type"])
+
+    df["Fleet Type"]=np.where(df["Fleet Type"].isin(["Bulkers"]),"Bulk Carrier",df["Fleet Type"])
+
+    df["Fleet Type"]=np.where(df["Fleet Type"].isin(["Fishing Vessel","Pleasure Craft","Service Ship","Cable Layer"]),
+                              "Others",df["Fleet Type"])
+    return df
+
+
+def processed_ports(df):
+    ##Ports part of processed_data
+    df["waiting_time"]=np.where(df.waiting_time<0.5,np.nan,df.waiting_time)
+    df["waiting_time"]=np.where(df.waiting_time>150,150,df.waiting_time)
+
+    df=df[~(df["Fleet Type"]=="Product Tankers")&(df["port_name"]!="Telfer")]
+    df=fleet_types(df.copy())
+
+    df=df[df["Fleet Type"].notnull()]
+
+    df=df[df["Fleet Type"].isin(["Containerships","Ro-Ro","Passenger Ship"])]
+
+    ##Quantiles on service and waiting times to remove outliers. 10% winzorization
+    ##Direct visit from after lockage.
+    grouped_df=df.groupby("port_name")
+    df=grouped_df.apply(lambda x: x[(x.waiting_time.isnull())|((x["service_time"]>=x["service_time"].quantile(0.05))&
+                                    (x["service_time"]<=x["service_time"].quantile(0.95))&
+                                    (x["waiting_time"]>=x["waiting_time"].quantile(0.05))&
+                                    (x["waiting_time"]<=x["waiting_time"].quantile(0.95))&
+                                    (x.waiting_time.notnull()))]).reset_index(drop=True)
+    return df
+
+
+def selection(canal,ports,date_from,date_to,ports_sel=["All"],type_vessel=["All"],size=["All"]):
+    ##Filtered frame of upper_text_p1
+    canal_in=canal[(canal.time_at_entrance.between(date_from,date_to))&(canal.direct_transit_boolean==True)].\
+        copy()
+    ports_in=ports[ports.initial_service.between(date_from,date_to)].\
+        copy()
+    canal_in=canal_in.assign(day=canal_in.time_at_entrance.dt.date)
+    canal_in=canal_in[["day","waiting_time","service_time","port_name","draught_ratio","StandardVesselType","GT"]]
+    canal_in["day"]=pd.to_datetime(canal_in.day)
+    ports_in=ports_in.assign(day=ports_in.initial_service.dt.date)
+    ports_in=ports_in[["day","waiting_time","service_time","port_name","draught_ratio","StandardVesselType","GT"]]
+    ports_in["day"]=pd.to_datetime(ports_in.day)
+
+    df_in=pd.concat([ports_in,canal_in],axis=0)
+
+    if "All" not in ports_sel:
+        df_in=df_in[df_in.port_name.isin(ports_sel)]
+
+    if "All" not in size:
+        df_in=df_in[df_in.GT.between(size[0],size[1])]
+
+    if "All" not in type_vessel:
+        df_in=df_in[df_in["StandardVesselType"].isin(type_vessel)]
+    return df_in
+
+
+def summary(df_in):
+    waiting_mean=df_in.waiting_time.mean()
+    ops=df_in.shape[0]
+    service_mean=df_in.service_time.mean()
+
+    return waiting_mean,ops,service_mean
+
+
+def weekly_draught(df_in):
+    ##Fig ratio
+    df_in=df_in[df_in.day>pd.to_datetime("01-01-2019")]
+    df_in=df_in.reset_index(drop=True)
+    series_grouped=[]
+    for name,row in df_in.\
+    groupby([df_in.day.dt.isocalendar().week,df_in.day.dt.year,"StandardVesselType"]):
+        series_grouped.append([pd.to_datetime(str(name[1])+"-"+str(name[0])+"-1",format='%Y-%W-%w'),name[2],row.draught_ratio.mean()])
+
+    series_grouped=pd.DataFrame(series_grouped,columns=["day","StandardVesselType","draught_ratio"]).sort_values(by=["day"])
+    return series_grouped
+
+
+def port_trims(df_in):
+    ##Service and waiting time
+    df_in=df_in[df_in.day>pd.to_datetime("01-01-2019")]
+    labels_w=[]
+    remove_w=[]
+    waiting=[]
+
+    for name,row in df_in.groupby("port_name"):
+        if len(row.waiting_time.dropna().tolist())>25:
+            labels_w.append(name)
+            wa_li=row.waiting_time[(row.waiting_time>1)&(row.waiting_time<row.waiting_time.quantile(0.95))&\
+                                   (row.waiting_time>row.waiting_time.quantile(0.05))]
+            waiting.append(wa_li.dropna().tolist())
+        else:
+            remove_w.append(name)
+
+    labels_s=[]
+    remove_s=[]
+    service=[]
+
+
+    for name,row in df_in.groupby("port_name"):
+        if len(row.service_time.dropna().tolist())>25:
+            labels_s.append(name)
+            se_li=row.service_time[(row.service_time>0)&(row.service_time<row.service_time.quantile(0.95))&\
+                   (row.service_time>row.service_time.quantile(0.05))]
+            service.append(se_li.dropna().tolist())
+        else:
+            remove_s.append(name)
+    return labels_w,waiting,labels_s,service
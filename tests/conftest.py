@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures. The raw CSVs are not part of the repository, tests build
+small synthetic frames of the same shape instead.
+"""
+
+import itertools
+import os
+import sys
+import uuid
+from types import SimpleNamespace
+
+import h3
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+##Figure caches of the app stay in process during tests
+os.environ["FIGURE_CACHE_DIR"] = ""
+
+TYPES = ["Container", "Cruise", "Vehicle", "Yacht"]
+
+
+def raw_emissions(rows=4000, missing_types=0.1, seed=0):
+    """
+    Rows shaped as data/emissions_type_monthly.csv around the canal, a share of them
+    without a vessel type.
+    """
+    rng = np.random.default_rng(seed)
+    cells = [h3.geo_to_h3(8.9 + rng.uniform(-.3, .3), -79.5 + rng.uniform(-.3, .3), 8) for _ in range(300)]
+    types = rng.choice(TYPES, rows).astype(object)
+    types[rng.random(rows) < missing_types] = np.nan
+    months = pd.date_range("2019-01-01", "2020-08-01", freq="MS").strftime("%Y-%m-%d")
+    return pd.DataFrame({"dt_pos_utc": rng.choice(months, rows),
+                         "StandardVesselType": types,
+                         "GrossTonnage": rng.choice([400., 8900., 5000., 60000., 170000., np.nan], rows),
+                         "res_8": rng.choice(cells, rows),
+                         "co2_t": rng.gamma(2, 3, rows),
+                         "ch4_t": rng.gamma(2, 0.01, rows)})
+
+
+def summed(raw):
+    ##Frame shaped as data_filtering.read_emissions returns it
+    from bitmap_index import gt_codes
+    from controls import GT_EDGES
+    from hexagons import h3_to_int
+
+    em = raw.assign(dt_pos_utc=pd.to_datetime(raw.dt_pos_utc),
+                    gt_code=gt_codes(raw.GrossTonnage.to_numpy(), GT_EDGES),
+                    res_8=h3_to_int(raw.res_8))
+    return em.drop(columns="GrossTonnage").astype({"StandardVesselType": "category"})
+
+
+PORTS = ["Pacific - PSA", "Pacific - PATSA", "Pacific - PPC Balboa", "MIT", "CCT",
+         "Atlantic - PPC Cristobal", "Telfer"]
+FLEET_TYPES = ["Containerships", "PCC", "Ro-Ro", "Cruise", "Passenger Ship", "Product Tankers",
+               "Bulkers", "MPP", "Offshore", "Fishing Vessel", np.nan]
+AIS_TYPES = ["Container Ship", "None", "Cruise", "Ro-Ro", "Passenger Ship", "General Cargo Ship", np.nan]
+##Slider edges, marks and values between them
+GTS = [400., 5000., 8900., 35000., 60000., 105000., 170000., np.nan]
+
+##Filter combinations checked against the former code: partial days, GT ranges on and off
+##the slider edges, and empty selections
+WINDOWS = [(pd.Timestamp("2018-12-31"), pd.Timestamp("2020-08-31")),
+           (pd.Timestamp("2019-03-05 13:27"), pd.Timestamp("2019-11-20 06:10")),
+           (pd.Timestamp("2019-06-01"), pd.Timestamp("2019-06-30 23:59:59")),
+           (pd.Timestamp("2021-01-01"), pd.Timestamp("2021-03-31"))]
+PORTS_SEL = [["All"], ["Pacific - PSA"], ["Panama Canal South", "MIT"], ["Telfer"]]
+TYPES_SEL = [["All"], ["Container"], ["Cruise", "Yacht"]]
+SIZES = [[400, 170000], [35000, 105000], [5000, 60000]]
+SELECTIONS = list(itertools.product(WINDOWS, PORTS_SEL, TYPES_SEL, SIZES))
+
+
+def plain(df):
+    ##Labels as the object columns the former code read
+    return df.astype({column: object for column in df.columns if df[column].dtype.name == "category"})
+
+
+def old_selection(data, window, ports_sel, types_sel, size):
+    ##Filtered frame of the former upper_text_p1 for a selection
+    import baseline
+
+    return baseline.selection(plain(data.canal), plain(data.ports), *window, ports_sel, types_sel, size)
+
+
+def missing(rng, values, share):
+    values = np.asarray(values, dtype=object if values.dtype == object else float)
+    values[rng.random(len(values)) < share] = np.nan
+    return values
+
+
+def timestamps(rng, rows):
+    ##Times to the minute, as the CSVs hold them
+    start, end = pd.Timestamp("2018-12-01").value, pd.Timestamp("2020-08-31 23:59").value
+    return pd.to_datetime(rng.integers(start, end, rows)).floor("min").strftime("%Y-%m-%d %H:%M:%S")
+
+
+def raw_ports(rows=3000, seed=1):
+    """
+    Rows shaped as data/ports_solutions_sp.csv, with the readings the cleaning drops or caps.
+    """
+    rng = np.random.default_rng(seed)
+    waiting = np.concatenate([rng.gamma(2, 10, rows - 40), rng.uniform(0, 0.5, 20), rng.uniform(150, 300, 20)])
+    return pd.DataFrame({"initial_service": timestamps(rng, rows),
+                         "service_time": missing(rng, rng.gamma(3, 5, rows), 0.05),
+                         "waiting_time": missing(rng, rng.permutation(waiting), 0.1),
+                         "port_name": missing(rng, rng.choice(PORTS, rows).astype(object), 0.02),
+                         "GT": rng.choice(GTS, rows),
+                         "vessel_type_main": rng.choice(np.array(AIS_TYPES, dtype=object), rows),
+                         "Fleet Type": rng.choice(np.array(FLEET_TYPES, dtype=object), rows),
+                         "draught_ratio": missing(rng, rng.uniform(0.5, 1, rows), 0.05),
+                         "StandardVesselType": missing(rng, rng.choice(TYPES, rows).astype(object), 0.03)})
+
+
+def raw_canal(rows=3000, seed=2):
+    """
+    Rows shaped as data/panama_transits_sp.csv, some of types out of the fleet.
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"time_at_entrance": timestamps(rng, rows),
+                         "direct_transit_boolean": rng.random(rows) < 0.7,
+                         "waiting_time": missing(rng, rng.gamma(2, 8, rows), 0.1),
+                         "service_time": missing(rng, rng.gamma(4, 3, rows), 0.05),
+                         "port_name": rng.choice(["Panama Canal South", "Panama Canal North"], rows),
+                         "draught_ratio": missing(rng, rng.uniform(0.5, 1, rows), 0.05),
+                         "StandardVesselType": rng.choice(TYPES + ["Fishing"], rows),
+                         "GT": rng.choice(GTS, rows)})
+
+
+def raw_gatun():
+    days = pd.date_range("2015-01-01", "2020-11-18", freq="D")
+    return pd.DataFrame({"Date": days.strftime("%Y-%m-%d"), "Overall": 12.0, "Change": np.nan,
+                         "gatun_depth": np.linspace(24, 26, len(days))})
+
+
+def raw_inputs():
+    return {"ports": raw_ports(), "canal": raw_canal(), "gatun": raw_gatun()}
+
+
+@pytest.fixture(scope="session")
+def cleaned():
+    """
+    Frames of data_filtering.build_datasets built from the synthetic raw inputs.
+    Shared by the tests, which must not modify them.
+    """
+    import data_filtering
+    from controls import FLEET
+
+    raw = raw_inputs()
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(data_filtering, "read_dataset", lambda name: raw[name].copy())
+        patch.setattr(data_filtering, "read_emissions", lambda: summed(raw_emissions(200)))
+        return data_filtering.build_datasets(FLEET)
+
+
+@pytest.fixture(scope="session")
+def derived(cleaned):
+    """
+    Event table, indexes and rollups of the cleaned frames as datasets.Datasets derives them,
+    under a version of their own.
+    """
+    from bitmap_index import BitmapIndex
+    from controls import GT_EDGES
+    from data_filtering import event_table
+    from rollups import DraughtRollup, KpiRollup
+
+    events = event_table(cleaned["canal"], cleaned["ports"])
+    index = BitmapIndex(events, ["port_name", "StandardVesselType"], gt="GT", gt_edges=GT_EDGES)
+    version = uuid.uuid4().hex[:16]
+    return SimpleNamespace(canal=cleaned["canal"], ports=cleaned["ports"], events=events, events_index=index,
+                           kpi=KpiRollup(events, index, GT_EDGES), draught=DraughtRollup(events, index, GT_EDGES),
+                           version=version, signature=version)
+
+
+@pytest.fixture
+def events_data(derived, monkeypatch):
+    ##Swapped in as the loaded datasets
+    import datasets
+
+    monkeypatch.setattr(datasets, "_current", derived)
+    return derived
+
+
+@pytest.fixture
+def raw_em():
+    return raw_emissions()
+
+
+@pytest.fixture
+def loaded(raw_em, monkeypatch):
+    """
+    Emissions datasets built from raw_em swapped in as the loaded ones, under a
+    signature of their own so no cached figure of another test is reused.
+    """
+    import datasets
+    from choropleth_map_emission import emissions_cube, emissions_geojson
+
+    em = summed(raw_em)
+    cube = emissions_cube(em)
+    data = SimpleNamespace(em=em, em_cube=cube, em_geojson=emissions_geojson(cube), pol=None,
+                           version=0, signature=uuid.uuid4().hex[:16])
+    monkeypatch.setattr(datasets, "_current", data)
+    return data
+
+
+@pytest.fixture(autouse=True)
+def repo_root(monkeypatch):
+    ##Data paths are relative to the repository
+    monkeypatch.chdir(ROOT)
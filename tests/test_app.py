@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize("route", ["/cache-stats", "/flight-stats", "/popular-states"])
+def test_stats_routes_need_the_admin_token(monkeypatch, route):
+    client = app.server.test_client()
+    monkeypatch.setattr(app, "ADMIN_TOKEN", None)
+    assert client.get(route, headers={"X-Admin-Token": ""}).status_code == 403
+
+    monkeypatch.setattr(app, "ADMIN_TOKEN", "secret")
+    assert client.get(route).status_code == 403
+    assert client.get(route, headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get(route, headers={"X-Admin-Token": "secret"}).status_code == 200
+
+
+def test_map_geometry_is_fetched_again_for_new_data(monkeypatch):
+    monkeypatch.setattr(app, "emissions_geometry", lambda res: {"res": res, "version": "new"})
+    geometry = {"res": 6, "version": "old"}
+
+    with pytest.raises(app.PreventUpdate):
+        app.update_map_geometry(6, {"res": 6, "version": "old"}, geometry)
+    assert app.update_map_geometry(7, {"res": 6, "version": "old"}, geometry) == {"res": 7, "version": "new"}
+    assert app.update_map_geometry(6, {"res": 6, "version": "new"}, geometry) == {"res": 6, "version": "new"}
+
+
+def test_repeated_callback_is_served_from_the_cache(loaded):
+    client = app.server.test_client()
+    body = {"output": "map_values.data", "outputs": {"id": "map_values", "property": "data"},
+            "inputs": [{"id": "selector", "property": "value", "value": "co2"},
+                       {"id": "zoom_slider", "property": "value", "value": 6},
+                       {"id": "year_slider", "property": "value", "value": [1, 18]},
+                       {"id": "types-dropdown", "property": "value", "value": ["All"]}],
+            "changedPropIds": ["selector.value"], "state": []}
+
+    first = client.post("/_dash-update-component", json=body)
+    hits = app.emissions_cache.stats()["hits"]
+    second = client.post("/_dash-update-component", json=body)
+    assert first.status_code == second.status_code == 200
+    assert app.emissions_cache.stats()["hits"] == hits + 1
+    assert first.get_json() == second.get_json()
+
+
+def test_slider_follows_the_loaded_datasets(monkeypatch):
+    import datasets
+    from datetime import datetime
+    from types import SimpleNamespace
+
+    for name in ["SLIDER_START", "SLIDER_MONTHS", "GATUN_END"]:
+        monkeypatch.setattr(app, name, getattr(app, name))
+    loaded = SimpleNamespace(slider=(datetime(2018, 12, 1), 30, None))
+    monkeypatch.setattr(datasets, "Datasets", lambda: loaded)
+    monkeypatch.setattr(datasets, "_current", None)
+
+    assert datasets.get() is loaded
+    assert (app.SLIDER_START, app.SLIDER_MONTHS, app.GATUN_END) == loaded.slider
+
+    ##Without a Gatun date the window ends with the last month
+    windows = []
+    monkeypatch.setattr(app, "lake_draught", lambda fr, to: windows.append((fr, to)))
+    app.update_gatun([0, 30])
+    assert windows[0][1] == datetime(2021, 6, 30)
+
+
+def test_only_valid_selections_are_counted(monkeypatch):
+    monkeypatch.setattr(app, "selections", app.collections.Counter())
+    monkeypatch.setattr(app, "SELECTIONS_MAX", 4)
+    monkeypatch.setattr(app, "port_options", lambda: [{"label": "Balboa", "value": "Balboa"}])
+    months = app.SLIDER_MONTHS
+
+    app.count_selection(["Balboa", "All"], ["Yacht"], [0, months], [400, 170000])
+    for ports, types, date, size in [(["Nowhere"], ["All"], [0, 1], [400, 500]),
+                                     (["Balboa", 1], ["All"], [0, 1], [400, 500]),
+                                     (["All"], ["Submarine"], [0, 1], [400, 500]),
+                                     (["All"], ["All"], [0, months + 1], [400, 500]),
+                                     (["All"], ["All"], [2, 1], [400, 500]),
+                                     (["All"], ["All"], [0, 1.5], [400, 500]),
+                                     (["All"], ["All"], [0, 1], [0, 500]),
+                                     (["All"], ["All"], [0, 1], ["400", 500]),
+                                     ("All", ["All"], [0, 1], [400, 500])]:
+        app.count_selection(ports, types, date, size)
+    assert app.popular_states() == [{"ports": ["All", "Balboa"], "types": ["Yacht"], "date": [0, months],
+                                     "size": [400, 170000], "count": 1}]
+
+    for month in range(5):
+        for _ in range(month + 1):
+            app.count_selection(["All"], ["All"], [0, month], [400, 170000])
+    assert len(app.selections) <= 4
+    assert app.popular_states(1)[0]["date"] == [0, 4]
+
+
+def test_figure_version_covers_every_module_of_the_app():
+    modules = sorted(path.name for path in app.pathlib.Path(app.__file__).parent.glob("*.py"))
+    assert sorted(app.FIGURE_MODULES) == [name for name in modules if name != "gunicorn.conf.py"]
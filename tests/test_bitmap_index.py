@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from bitmap_index import BitmapIndex, gt_bucket_bounds, gt_codes, gt_range_codes
+from controls import GT_EDGES, GT_MAX, GT_MIN
+
+EDGES = [10., 20., 30.]
+
+##Ranges on the slider edges, between them, off both ends and empty
+RANGES = [(GT_MIN, GT_MAX), (35000, 105000), (5000, 60000), (8900, 8900), (0, 300),
+          (200000, 300000), (100, 400), (170000, 250000), (60000, 5000)]
+
+
+def gts(rows=2000, seed=3):
+    ##Edges and range ends, values next to them, below and above the slider and NaN, in random order
+    rng = np.random.default_rng(seed)
+    edges = np.asarray(GT_EDGES + [end for gt_range in RANGES for end in gt_range], dtype=float)
+    values = np.concatenate([edges, edges - 0.5, edges + 0.5, [0., 100., 250000., np.nan],
+                             rng.uniform(0, 200000, rows).round()])
+    return pd.Series(rng.permutation(values))
+
+
+@pytest.mark.parametrize("value,code", [(10, 0), (15, 1), (20, 2), (25, 3), (30, 4), (5, -1), (35, 5),
+                                        (np.nan, -2), (10.000001, 1), (29.999999, 3)])
+def test_gt_code_of_edges_and_open_intervals(value, code):
+    assert gt_codes([value], EDGES)[0] == code
+
+
+def test_gt_codes_match_their_bucket_bounds():
+    gt = gts()
+    codes = gt_codes(gt, GT_EDGES)
+    assert (codes[gt.isnull()] == -2).all()
+    for code in range(-1, 2 * len(GT_EDGES)):
+        lo, hi, lo_open, hi_open = gt_bucket_bounds(code, GT_EDGES)
+        assert lo_open == hi_open
+        inside = ((gt > lo) & (gt < hi)) if lo_open else gt.between(lo, hi)
+        pd.testing.assert_series_equal(pd.Series(codes == code), inside, check_names=False)
+
+
+@pytest.mark.parametrize("i,j", [(0, len(GT_EDGES) - 1), (1, 4), (3, 3), (0, 0)])
+def test_slider_range_on_edges_is_the_codes_between(i, j):
+    full, partial = gt_range_codes((GT_EDGES[i], GT_EDGES[j]), GT_EDGES)
+    assert full == list(range(2 * i, 2 * j + 1))
+    assert partial == []
+
+
+@pytest.mark.parametrize("gt_range", RANGES)
+def test_full_and_partial_codes_match_between(gt_range):
+    gt = gts()
+    codes = gt_codes(gt, GT_EDGES)
+    full, partial = gt_range_codes(gt_range, GT_EDGES)
+    assert not set(full) & set(partial)
+
+    expected = gt.between(*gt_range)
+    assert expected[np.isin(codes, full)].all()
+    assert not expected[~np.isin(codes, full + partial)].any()
+    ##Exact comparison on the rows of the partial codes only
+    selected = np.isin(codes, full) | (np.isin(codes, partial) & expected)
+    assert (selected == expected).all()
+
+
+@pytest.mark.parametrize("gt_range", RANGES + [None])
+def test_select_matches_isin_and_between(gt_range):
+    rng = np.random.default_rng(4)
+    gt = gts()
+    events = pd.DataFrame({"port_name": rng.choice(["MIT", "CCT", "Balboa"], len(gt)),
+                           "StandardVesselType": rng.choice(["Container", "Cruise", "Yacht"], len(gt)),
+                           "GT": gt})
+    index = BitmapIndex(events, ["port_name", "StandardVesselType"], gt="GT", gt_edges=GT_EDGES)
+
+    for lo, hi in [(0, len(events)), (17, 1203), (500, 500)]:
+        rows = events.iloc[lo:hi]
+        expected = rows.port_name.isin(["MIT", "Balboa"]) & rows.StandardVesselType.isin(["Yacht"])
+        if gt_range is not None:
+            expected &= rows.GT.between(*gt_range)
+        mask = index.select(lo, hi, gt=gt_range, port_name=["MIT", "Balboa", "Nowhere"],
+                            StandardVesselType=["Yacht"])
+        assert (mask == expected.to_numpy()).all()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import plotly.graph_objects as go
+import pytest
+
+from cache import Decoded, FigureCache, SingleFlight
+
+CALLERS = 8
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def in_flight(flight, compute):
+    """
+    Outcome of CALLERS concurrent flight.do on one key, each a result or an exception.
+    compute runs once every caller joined the flight.
+    """
+    release = threading.Event()
+
+    def gated():
+        release.wait(5)
+        return compute()
+
+    def call(_):
+        try:
+            return flight.do("key", gated)
+        except Exception as error:
+            return error
+
+    with ThreadPoolExecutor(max_workers=CALLERS) as pool:
+        outcomes = pool.map(call, range(CALLERS))
+        wait_for(lambda: flight.stats()["coalesced"] >= CALLERS - 1)
+        release.set()
+        return list(outcomes)
+
+
+def test_concurrent_callers_share_one_computation():
+    flight = SingleFlight()
+    calls = []
+
+    outcomes = in_flight(flight, lambda: calls.append(1) or object())
+    assert len(calls) == 1
+    assert all(outcome is outcomes[0] for outcome in outcomes)
+    assert flight.stats() == {"computed": 1, "coalesced": CALLERS - 1, "failed": 0, "in_flight": 0}
+
+
+def test_every_waiter_gets_the_exception():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("no data")
+
+    outcomes = in_flight(flight, fail)
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+    assert flight.stats()["failed"] == 1
+
+
+def test_failed_key_is_computed_again():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("no data")
+
+    with pytest.raises(ValueError):
+        flight.do("key", fail)
+    assert flight.do("key", lambda: 42) == 42
+    assert flight.stats() == {"computed": 2, "coalesced": 0, "failed": 1, "in_flight": 0}
+
+
+class Tier(dict):
+    ##Shared tier with the calls of diskcache.Cache used by FigureCache
+    def set(self, key, value, expire=None):
+        self[key] = value
+
+
+def figure(title):
+    return go.Figure(layout=dict(title_text=title))
+
+
+def test_decoded_holds_the_value_and_its_json_size():
+    decoded = Decoded('{"data": [], "layout": {"title": "é"}}')
+    assert decoded.value == {"data": [], "layout": {"title": "é"}}
+    assert decoded.nbytes == len('{"data": [], "layout": {"title": "é"}}')
+
+
+def test_figure_cache_builds_each_key_once():
+    figures = FigureCache("test-hits")
+    built = []
+
+    def build():
+        built.append(1)
+        return figure("a")
+
+    first = figures.get_or_compute(("v1", "a"), build)
+    assert figures.get_or_compute(("v1", "a"), build) is first
+    assert first["layout"]["title"]["text"] == "a"
+    assert len(built) == 1
+    assert figures.stats()["hits"] == 1
+
+
+def test_figure_cache_evicts_the_least_recently_used():
+    figures = FigureCache("test-eviction", max_entries=2)
+    for key in ["a", "b", "a", "c"]:
+        figures.get_or_compute((key,), lambda: figure(key))
+    assert figures.stats()["entries"] == 2
+    figures.get_or_compute(("b",), lambda: figure("b"))
+    assert figures.stats()["misses"] == 4
+
+
+def test_shared_tier_serves_other_processes_of_the_same_code():
+    tier = Tier()
+    FigureCache("test-shared", shared=tier, version="code1").get_or_compute(("a",), lambda: figure("a"))
+
+    other = FigureCache("test-shared", shared=tier, version="code1")
+    assert other.get_or_compute(("a",), lambda: pytest.fail("read from the tier"))["layout"]["title"]["text"] == "a"
+    assert other.stats()["shared_hits"] == 1
+
+    deployed = FigureCache("test-shared", shared=tier, version="code2")
+    assert deployed.get_or_compute(("a",), lambda: figure("new"))["layout"]["title"]["text"] == "new"
+    assert deployed.stats()["shared_hits"] == 0
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+import baseline
+import data_filtering
+from conftest import WINDOWS, raw_ports
+from controls import FLEET
+from data_filtering import TYPE_RULES, apply_rules, quantile_mask, time_bounds, time_slice
+
+##Columns of the cleaned ports, vessel_type_main is read by the cleaning only
+PORT_COLUMNS = ["initial_service", "service_time", "waiting_time", "port_name", "GT",
+                "Fleet Type", "draught_ratio", "StandardVesselType"]
+
+
+def cleaned_ports(raw, monkeypatch):
+    monkeypatch.setattr(data_filtering, "read_dataset", lambda name: raw.copy() if name == "ports" else
+                        pd.DataFrame(columns=data_filtering.SCHEMAS[name]["columns"]))
+    return data_filtering.processed_data(FLEET)[1]
+
+
+def test_winsorization_matches_the_former_apply(monkeypatch):
+    raw = raw_ports()
+    ports = cleaned_ports(raw, monkeypatch)
+
+    expected = baseline.processed_ports(raw.copy())
+    pdt.assert_frame_equal(ports[PORT_COLUMNS], expected[PORT_COLUMNS])
+
+
+def test_type_rules_match_the_former_np_where_chain():
+    raw = raw_ports(rows=5000, seed=3)
+    ports, touched = apply_rules(raw.copy(), TYPE_RULES)
+
+    expected = baseline.fleet_types(raw.copy())
+    for column in ["Fleet Type", "port_name"]:
+        pdt.assert_series_equal(ports[column], expected[column], check_dtype=False)
+    pcc = (raw["Fleet Type"] == "PCC") & (raw.vessel_type_main != "Container Ship")
+    assert touched["PCC as Ro-Ro"] == pcc.sum()
+
+
+def test_quantile_mask_without_any_key_keeps_nothing():
+    df = pd.DataFrame({"port_name": [np.nan, np.nan], "waiting_time": [1.0, 2.0]})
+    assert not quantile_mask(df, "port_name", ["waiting_time"]).any()
+    assert quantile_mask(df.iloc[:0], "port_name", ["waiting_time"]).empty
+
+
+def sorted_times(rows=3000, seed=5):
+    ##Midnights, repeated times and partial days, sorted with NaT last as the loaded frames
+    rng = np.random.default_rng(seed)
+    unit = rng.choice([1, 3600, 86400], rows)
+    seconds = rng.integers(0, 600 * 86400, rows) // unit * unit
+    times = pd.Series(pd.Timestamp("2018-12-01") + pd.to_timedelta(seconds, unit="s"))
+    times[rng.random(rows) < 0.02] = pd.NaT
+    return pd.DataFrame({"time": times.sort_values(na_position="last").reset_index(drop=True)})
+
+
+@pytest.mark.parametrize("date_from,date_to", WINDOWS + [
+    (pd.Timestamp("2019-02-01"), pd.Timestamp("2019-02-01")),
+    (pd.Timestamp("2019-05-10 06:00"), pd.Timestamp("2019-05-10 18:00")),
+    (pd.Timestamp("2017-01-01"), pd.Timestamp("2018-11-30")),
+    (pd.Timestamp("2019-09-01"), pd.Timestamp("2019-08-01"))])
+def test_time_window_matches_between(date_from, date_to):
+    df = sorted_times()
+    ##Window ends on rows of the frame as well
+    ends = [(date_from, date_to), tuple(df.time.dropna().sample(2, random_state=6).sort_values())]
+    for fr, to in ends:
+        expected = df[df.time.between(fr, to)]
+        assert not expected.time.isnull().any()
+        pdt.assert_frame_equal(time_slice(df, "time", fr, to), expected)
+        lo, hi = time_bounds(df, "time", fr, to)
+        assert max(hi - lo, 0) == len(expected)
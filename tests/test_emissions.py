@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from choropleth_map_emission import emissions_cube, sum_by_hexagon
+from conftest import summed
+from controls import GT_EDGES, GT_MARKS
+from data_filtering import NO_TYPE, read_emissions
+
+
+@pytest.mark.parametrize("resolution", [4, 5, 6, 7, 8])
+def test_all_types_keep_rows_without_type(raw_em, resolution):
+    em = summed(raw_em)
+    cube = emissions_cube(em)
+    fr, to = pd.Timestamp("2019-04-01"), pd.Timestamp("2019-12-31")
+
+    hexes = sum_by_hexagon(em, resolution, None, fr, to, cube=cube)
+    window = raw_em[pd.to_datetime(raw_em.dt_pos_utc).between(fr, to)]
+    assert hexes.co2_t.sum() == pytest.approx(window.co2_t.sum())
+    assert hexes.ch4_t.sum() == pytest.approx(window.ch4_t.sum())
+    if resolution == 8:
+        assert set(hexes.hex_id) == set(window.res_8)
+
+
+def test_type_filter_leaves_out_rows_without_type(raw_em):
+    em = summed(raw_em)
+    fr, to = pd.Timestamp("2019-01-01"), pd.Timestamp("2020-08-31")
+
+    hexes = sum_by_hexagon(em, 8, None, fr, to, vessel_type=["Cruise"], cube=emissions_cube(em))
+    assert hexes.co2_t.sum() == pytest.approx(raw_em[raw_em.StandardVesselType == "Cruise"].co2_t.sum())
+
+
+def test_gt_range_on_edges_is_exact(raw_em):
+    em = summed(raw_em)
+    fr, to = pd.Timestamp("2019-01-01"), pd.Timestamp("2020-08-31")
+
+    hexes = sum_by_hexagon(em, 6, None, fr, to, gt=[GT_EDGES[1], GT_EDGES[-1]], cube=emissions_cube(em))
+    expected = raw_em[raw_em.GrossTonnage.between(GT_EDGES[1], GT_EDGES[-1])].co2_t.sum()
+    assert hexes.co2_t.sum() == pytest.approx(expected)
+    assert not np.isnan(hexes.co2_t).any()
+
+
+def test_read_emissions_matches_the_csv(raw_em, tmp_path):
+    path = tmp_path / "emissions.csv"
+    raw_em.to_csv(path, index=False)
+
+    em = read_emissions(chunksize=250, path=str(path))
+    assert em.co2_t.sum() == pytest.approx(raw_em.co2_t.sum())
+    assert (em.StandardVesselType == NO_TYPE).sum() > 0
+    assert not em.duplicated(["dt_pos_utc", "StandardVesselType", "gt_code", "res_8"]).any()
+    by_type = em.groupby("StandardVesselType").co2_t.sum()
+    expected = raw_em.fillna({"StandardVesselType": NO_TYPE}).groupby("StandardVesselType").co2_t.sum()
+    pd.testing.assert_series_equal(by_type, expected, check_names=False)
+
+
+def test_slider_marks_are_bucket_edges():
+    assert set(GT_MARKS) <= set(GT_EDGES)
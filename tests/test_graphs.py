@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+The port graphs checked against the loops they replaced, see baseline.py, over filter
+combinations with partial days, GT ranges on and off the slider edges and empty selections.
+"""
+
+import pandas as pd
+import pytest
+
+import app
+import baseline
+from conftest import SELECTIONS, old_selection
+
+
+@pytest.mark.parametrize("window,ports_sel,types_sel,size", SELECTIONS)
+def test_port_trims_match_the_former_loops(events_data, window, ports_sel, types_sel, size):
+    labels_w, waiting, labels_s, service = baseline.port_trims(old_selection(events_data, window, ports_sel,
+                                                                              types_sel, size))
+
+    key = app.filter_key(*window, ports_sel, types_sel, size)
+    df_in = app.filtered_events(events_data, key)
+    df_in = df_in[df_in.day > pd.to_datetime("01-01-2019")]
+    for column, floor, labels, values in [("waiting_time", 1, labels_w, waiting),
+                                          ("service_time", 0, labels_s, service)]:
+        new_labels, new_values = app.trimmed_by_port(df_in, column, floor)
+        assert new_labels == labels
+        assert [sorted(v) for v in new_values] == [sorted(v) for v in values]
+
+
+@pytest.mark.parametrize("ports_sel,types_sel,date", [(["Telfer"], ["All"], [0, 20]),
+                                                      (["CCT"], ["Yacht"], [0, 0]),
+                                                      (["Telfer"], ["Container"], [3, 5])])
+def test_graphs_of_an_empty_selection_are_placeholders(events_data, ports_sel, types_sel, date):
+    service, waiting, ratio = app.update_graphs(ports_sel, types_sel, date, [400, 170000])
+    for figure in (service, waiting):
+        assert figure["data"] == []
+        assert figure["layout"]["annotations"][0]["text"] == "max=5"
+    assert ratio["data"] == []
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import copy
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+
+
+def test_concurrent_maps_keep_their_own_viewport(loaded):
+    before = copy.deepcopy(app.layout_map)
+    viewports = [(None, None, None), (8.9, -79.5, 9), (9.35, -79.9, 11.5), (8.1, -78.7, 6)]
+    requests = list(itertools.product(["co2", "ch4"], [4, 6, 8], viewports))
+
+    def emissions(request):
+        ghg, res, (lat, lon, zoom) = request
+        return app.emissions_map(ghg, res, "2019-01-01", "2020-08-31", lat=lat, lon=lon, zoom=zoom)
+
+    def layout(request):
+        ghg, res, (lat, lon, zoom) = request
+        return app.map_layout(lat, lon, zoom)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        figures = pool.map(emissions, requests * 3)
+        layouts = pool.map(layout, requests * 3)
+        results = list(zip(requests * 3, figures, layouts))
+
+    default = before["mapbox"]
+    for (ghg, res, (lat, lon, zoom)), figure, layout_in in results:
+        expected = dict(center=dict(lon=lon, lat=lat), zoom=zoom) if lat is not None else default
+        for mapbox in (figure["layout"]["mapbox"], layout_in["mapbox"]):
+            assert mapbox["center"] == expected["center"]
+            assert mapbox["zoom"] == expected["zoom"]
+    assert app.layout_map == before
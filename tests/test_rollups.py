@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Rollup answers checked against the pandas code they replaced, see baseline.py.
+"""
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+import app
+import baseline
+from conftest import SELECTIONS, old_selection
+
+
+@pytest.mark.parametrize("window,ports_sel,types_sel,size", SELECTIONS)
+def test_summary_matches_the_former_means(derived, window, ports_sel, types_sel, size):
+    waiting, ops, service = baseline.summary(old_selection(derived, window, ports_sel, types_sel, size))
+
+    new_waiting, new_ops, new_service = derived.kpi.summary(*app.filter_key(*window, ports_sel, types_sel, size))
+    assert new_ops == ops
+    for new, old in [(new_waiting, waiting), (new_service, service)]:
+        assert np.isnan(new) if np.isnan(old) else new == pytest.approx(old, rel=1e-12)
+
+
+def by_day(series):
+    ##Rows of one day come in any order from the former sort
+    return series.sort_values(["day", "StandardVesselType"]).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("window,ports_sel,types_sel,size", SELECTIONS)
+def test_weekly_draught_matches_the_former_loop(derived, window, ports_sel, types_sel, size):
+    expected = baseline.weekly_draught(old_selection(derived, window, ports_sel, types_sel, size))
+
+    key = app.filter_key(*window, ports_sel, types_sel, size)
+    ##As port_graphs asks for it, the chart starts on the second day of 2019
+    since = pd.to_datetime("01-01-2019") + pd.Timedelta(days=1)
+    weekly = derived.draught.weekly(max(key[0], since), *key[1:])
+    assert len(weekly) == len(expected)
+    if len(expected):
+        pdt.assert_frame_equal(by_day(weekly).astype({"StandardVesselType": object}), by_day(expected),
+                               check_dtype=False, rtol=1e-12)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_filtering
+import datasets
+import store
+from conftest import raw_emissions, summed
+
+
+def frames():
+    ##Cleaned frames as data_filtering.build_datasets returns them
+    days = pd.date_range("2019-01-01", "2019-06-30", freq="D")
+    gatun = pd.DataFrame({"Date": days, "Overall": np.float32(12.0), "Change": np.float32(0.0),
+                          "gatun_depth": np.linspace(24, 26, len(days)).astype("float32")})
+    events = pd.DataFrame({"time": pd.date_range("2019-01-01", periods=30, freq="5D"),
+                           "port_name": pd.Categorical(["Balboa", "Cristobal"] * 15),
+                           "StandardVesselType": pd.Categorical(["Container", "Cruise", "Yacht"] * 10),
+                           "GT": np.float32(5000.)})
+    canal = events.rename(columns={"time": "time_at_entrance"})
+    ports = events.rename(columns={"time": "initial_service"})
+    return {"canal": canal, "ports": ports, "gatun": gatun, "em": summed(raw_emissions(500))}
+
+
+@pytest.fixture
+def built(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_filtering, "build_datasets", lambda fleet: frames())
+    monkeypatch.setattr(data_filtering, "report_memory", lambda frames: None)
+    path = str(tmp_path / "store")
+    return path, store.build(path)
+
+
+def test_lazy_dataset_reads_only_the_months_of_the_window(built):
+    path, manifest = built
+    canal, ports, gatun, em = store.load_store(path, lazy=("gatun",))
+    assert gatun is None
+    assert len(canal) == 30
+
+    rows = store.load_range("gatun", pd.Timestamp("2019-03-10"), pd.Timestamp("2019-04-02"), store=path)
+    assert rows.Date.min() == pd.Timestamp("2019-03-01")
+    assert rows.Date.max() == pd.Timestamp("2019-04-30")
+    assert rows.dtypes.equals(frames()["gatun"].dtypes)
+    assert store.load_range("gatun", pd.Timestamp("2020-01-01"), pd.Timestamp("2020-02-01"), store=path).empty
+
+
+def test_store_with_other_columns_is_not_loaded(built):
+    path, manifest = built
+    manifest["datasets"]["canal"]["schema"] = "0" * 16
+    assert store.load_store(path, manifest=manifest) is None
+
+
+def test_store_built_from_other_inputs_is_not_loaded(built, tmp_path, monkeypatch):
+    source = tmp_path / "emissions.csv"
+    source.write_text("co2_t\n1\n")
+    monkeypatch.setattr(data_filtering, "SOURCES", [str(source)])
+    path, manifest = built
+    store.build(path)
+    assert store.load_store(path) is not None
+
+    ##Same content written again, only the time changed
+    source.write_text("co2_t\n1\n")
+    assert store.load_store(path) is not None
+    source.write_text("co2_t\n2\n")
+    assert store.load_store(path) is None
+
+
+def test_slider_of_the_frames_matches_the_manifest(cleaned, tmp_path, monkeypatch):
+    monkeypatch.setattr(data_filtering, "build_datasets", lambda fleet: dict(cleaned))
+    monkeypatch.setattr(data_filtering, "report_memory", lambda frames: None)
+    manifest = store.build(str(tmp_path / "store"))
+
+    slider = datasets.slider_range(cleaned["canal"], cleaned["ports"], cleaned["gatun"])
+    assert slider == store.slider_range(manifest)
+    assert slider[1] == 20